@@ -1,13 +1,262 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, g, request, jsonify, render_template, send_from_directory
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import re
 import json
-from isbn13_crt import generate_isbn, check_isbn, isbn_storage
+import time
+from contextlib import ExitStack
+from check_file_isbns import find_invalid_isbns
+from isbn13_crt import (
+    generate_isbn, generate_isbns, iter_generate_isbns, check_isbn, cached_check_isbn, fast_check_isbn,
+    suggest_isbns, get_storage, DEFAULT_SCHEME, MAX_BATCH_SIZE
+)
+from isbn_jobs import JobManager, MAX_JOB_SIZE
+from isbn_metrics import registry as metrics, HTTP_REQUEST_SECONDS
+from isbn_profiling import profiling, PROFILE_MODES
+
+# Largest page of ISBNs returned by /api/batch-jobs/<job_id>/isbns
+MAX_JOB_PAGE_SIZE = 10000
+
+# Number of rows collected into one chunk of a streaming response
+STREAM_ROWS_PER_CHUNK = 1000
+
+# Largest number of suggested ISBNs returned by /api/validate
+MAX_SUGGESTIONS = 100
+
+# Largest number of ISBNs accepted by /api/validate-batch
+MAX_VALIDATE_BATCH_SIZE = 1000000
+
+# Largest request body accepted by /api/validate-batch (about 14 bytes per ISBN line)
+MAX_VALIDATE_BODY_BYTES = 16 << 20
+
+# Size of the pieces an uploaded ISBN list is read in
+UPLOAD_CHUNK_SIZE = 64 << 10
+
+# Whether requests may ask to be profiled with an X-Profile header outside debug mode; keep this off in production
+PROFILE_REQUESTS = os.environ.get("ISBN_PROFILE_REQUESTS", "0").lower() in ("1", "true", "yes", "on")
+
+# Content types of the streaming output formats
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
 
 # Create Flask app
 app = Flask(__name__, static_folder='static')
 
+# Background workers for batch generation jobs
+job_manager = JobManager()
+
+@app.before_request
+def start_request_timer():
+    """Remember when the request started, if metrics are enabled"""
+    if metrics.enabled:
+        request.environ['isbn.start_time'] = time.perf_counter()
+
+@app.before_request
+def start_request_profile():
+    """Profile the request if it carries an X-Profile header (cpu or memory) and profiling is allowed"""
+    mode = request.headers.get('X-Profile')
+    if not mode or not (app.debug or PROFILE_REQUESTS):
+        return None
+    if mode not in PROFILE_MODES:
+        return jsonify({'error': f"X-Profile must be one of {', '.join(PROFILE_MODES)}"}), 400
+    
+    # Keep the profile open until the response is ready; streamed bodies are only partly covered
+    g.profile_stack = ExitStack()
+    g.profile_result = g.profile_stack.enter_context(profiling(f"{request.method}-{request.path}", mode))
+    return None
+
+@app.after_request
+def finish_request_profile(response):
+    """Write the profile of the request and report where it went"""
+    profile_stack = g.pop('profile_stack', None)
+    if profile_stack is not None:
+        profile_stack.close()
+        response.headers['X-Profile-Output'] = ', '.join(g.profile_result.paths)
+    return response
+
+@app.teardown_request
+def close_request_profile(error):
+    """Stop a profile left open by a request that failed before its response was made"""
+    profile_stack = g.pop('profile_stack', None)
+    if profile_stack is not None:
+        profile_stack.close()
+
+@app.after_request
+def record_request_time(response):
+    """Record the request latency by endpoint and status, if metrics are enabled"""
+    start_time = request.environ.get('isbn.start_time')
+    if start_time is not None:
+        # Label with the route rule rather than the path, so job ids do not create new series
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start_time, endpoint, str(response.status_code))
+    return response
+
+def parse_batch_request(data, max_count):
+    """
+    Read the prefix and count of a batch generation request.
+    
+    Parameters:
+    - data: The JSON body of the request
+    - max_count: The largest number of ISBNs that may be requested
+    
+    Returns a tuple (prefix, count, use_multiples, error), where error is a message if the request is invalid.
+    """
+    country_code = data.get('country_code', '3')
+    publisher_code = data.get('publisher_code', '16')
+    count = int(data.get('count', 10))
+    use_multiples = data.get('use_multiples', True)
+    
+    # Validate inputs
+    if not re.match(r'^\d$', country_code):
+        return None, count, use_multiples, 'Country code must be a single digit (0-9)'
+        
+    if not re.match(r'^\d{1,2}$', publisher_code):
+        return None, count, use_multiples, 'Publisher code must be 1-2 digits (0-99)'
+    
+    if count < 1 or count > max_count:
+        return None, count, use_multiples, f'Count must be between 1 and {max_count}'
+    
+    # Form the prefix from the two-digit publisher code
+    prefix = f"978{country_code}{int(publisher_code):02d}"
+    return prefix, count, use_multiples, None
+
+def stream_rows(rows, fieldnames, output_format):
+    """
+    Serialize rows for a streaming response.
+    
+    Parameters:
+    - rows: An iterable of dictionaries with the given fields
+    - fieldnames: The fields of each row, in CSV column order
+    - output_format: "ndjson" for one JSON object per line, or "csv"
+    
+    Yields the output in chunks of STREAM_ROWS_PER_CHUNK rows.
+    """
+    if output_format == 'csv':
+        # The fields are plain digit strings, so they never need CSV quoting
+        yield ','.join(fieldnames) + '\n'
+        format_row = lambda row: ','.join(str(row[field]) for field in fieldnames) + '\n'
+    else:
+        format_row = lambda row: json.dumps(row) + '\n'
+    
+    lines = []
+    for row in rows:
+        lines.append(format_row(row))
+        if len(lines) == STREAM_ROWS_PER_CHUNK:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+def read_request_body(stream, max_bytes=MAX_VALIDATE_BODY_BYTES):
+    """
+    Read a whole request body, stopping as soon as it grows past a limit.
+    
+    Unlike a Content-Length check this also caps chunked uploads, which announce no size.
+    
+    Parameters:
+    - stream: The binary request body stream
+    - max_bytes: The largest body size accepted
+    
+    Returns the body as bytes. Raises RequestEntityTooLarge once more than max_bytes
+    have been read.
+    """
+    chunks = []
+    read = 0
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        read += len(chunk)
+        if read > max_bytes:
+            raise RequestEntityTooLarge()
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+def iter_uploaded_isbns(stream, max_bytes=MAX_VALIDATE_BODY_BYTES):
+    """
+    Read the ISBNs of an uploaded list, one per line, without buffering the whole body.
+    
+    Parameters:
+    - stream: The binary request body stream
+    - max_bytes: The largest body size accepted
+    
+    Yields each non-empty line as stripped bytes. Raises RequestEntityTooLarge once
+    more than max_bytes have been read.
+    """
+    pending = b''
+    read = 0
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        read += len(chunk)
+        if read > max_bytes:
+            raise RequestEntityTooLarge()
+        
+        # Keep the last, possibly incomplete line for the next chunk
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    
+    pending = pending.strip()
+    if pending:
+        yield pending
+
+def validate_isbn_batch(isbns, corrections=False, max_count=MAX_VALIDATE_BATCH_SIZE):
+    """
+    Validate many ISBNs in vectorized batches.
+    
+    Parameters:
+    - isbns: An iterable of ISBNs as bytes
+    - corrections: Whether to include a corrected ISBN for every invalid 13-digit ISBN
+    - max_count: The largest number of ISBNs accepted
+    
+    Returns a dictionary with one validity bit (1 or 0) per ISBN, the aggregate counts
+    and, if requested, the corrected ISBNs by position. Raises RequestEntityTooLarge
+    if there are more than max_count ISBNs.
+    """
+    valid = []
+    malformed = 0
+    
+    def well_formed_records():
+        nonlocal malformed
+        for index, isbn in enumerate(isbns):
+            if index >= max_count:
+                raise RequestEntityTooLarge()
+            if len(isbn) == 13 and isbn.isdigit():
+                valid.append(1)
+                yield index, isbn
+            else:
+                valid.append(0)
+                malformed += 1
+    
+    # Clear the bit of every ISBN that does not follow the CRT rules
+    invalid = []
+    def on_invalid(row):
+        valid[row[0]] = 0
+        invalid.append((row[0], row[1]))
+    find_invalid_isbns(well_formed_records(), on_invalid)
+    
+    result = {
+        'count': len(valid),
+        'valid_count': len(valid) - malformed - len(invalid),
+        'invalid_count': len(invalid),
+        'malformed_count': malformed,
+        'valid': valid
+    }
+    if corrections:
+        # Keyed by the position of the ISBN in the request
+        result['corrected_isbns'] = {
+            str(index): check_isbn(isbn, verbose=False)[1]['corrected_isbn'] for index, isbn in invalid
+        }
+    return result
+
 @app.route('/')
 def index():
     """Serve the main HTML page"""
@@ -56,63 +305,77 @@ def api_validate():
     """Validate an ISBN"""
     data = request.json
     isbn = data.get('isbn', '')
+    suggestions = data.get('suggestions', 0)
     
     # Validate input
-    if not isbn or not re.match(r'^\d{13}$', isbn):
+    if not isinstance(isbn, str) or not re.fullmatch(r'[0-9]{13}', isbn):
         return jsonify({'error': 'ISBN must be 13 digits'}), 400
     
-    # Check the ISBN
-    is_valid, info = check_isbn(isbn, verbose=False)
+    if isinstance(suggestions, bool) or not isinstance(suggestions, int) or not 0 <= suggestions <= MAX_SUGGESTIONS:
+        return jsonify({'error': f'Suggestions must be between 0 and {MAX_SUGGESTIONS}'}), 400
+    
+    # Check the ISBN on the fast path; the remainders follow from its residue
+    is_valid, publisher_code, residue = fast_check_isbn(isbn)
+    if publisher_code is None:
+        return jsonify({'error': 'ISBN must be 13 digits'}), 400
+    moduli = DEFAULT_SCHEME.moduli
     
     # Prepare response
     response = {
         'isbn': isbn,
         'valid': is_valid,
-        'publisher_code': info['publisher_code'],
-        'expected_remainders': info['expected_remainders'],
-        'actual_remainders': info['actual_remainders'],
-        'in_storage': info.get('in_storage', False)
+        'publisher_code': publisher_code,
+        'expected_remainders': [publisher_code % m for m in moduli],
+        'actual_remainders': [residue % m for m in moduli],
+        'in_storage': is_valid and get_storage().is_isbn_generated(isbn)
     }
     
-    if not is_valid and 'corrected_isbn' in info:
-        response['corrected_isbn'] = info['corrected_isbn']
+    if not is_valid:
+        # Only invalid ISBNs need the full check, for the correction; popular ones come from the validation cache
+        response['corrected_isbn'] = cached_check_isbn(isbn)[1]['corrected_isbn']
+    
+    if suggestions:
+        # The nearest valid ISBNs with the same prefix that have not been generated yet
+        response['suggested_isbns'] = suggest_isbns(isbn, suggestions)
     
     return jsonify(response)
 
+@app.route('/api/validate-batch', methods=['POST'])
+def api_validate_batch():
+    """Validate many ISBNs at once, sent as a JSON array or as a list with one ISBN per line"""
+    if request.content_length is not None and request.content_length > MAX_VALIDATE_BODY_BYTES:
+        raise RequestEntityTooLarge()
+    corrections = request.args.get('corrections', 'false').lower() in ('1', 'true', 'yes')
+    
+    if request.is_json:
+        # Either a bare array or an object with an "isbns" array
+        try:
+            data = json.loads(read_request_body(request.stream, MAX_VALIDATE_BODY_BYTES))
+        except ValueError:
+            return jsonify({'error': 'Invalid JSON body'}), 400
+        if isinstance(data, dict):
+            corrections = data.get('corrections', corrections)
+            if not isinstance(corrections, bool):
+                return jsonify({'error': 'Corrections must be true or false'}), 400
+            data = data.get('isbns')
+        if not isinstance(data, list):
+            return jsonify({'error': 'Expected a JSON array of ISBNs'}), 400
+        isbns = (str(isbn).encode() for isbn in data)
+    else:
+        # Any other body is read as it arrives, one ISBN per line
+        isbns = iter_uploaded_isbns(request.stream)
+    
+    return jsonify(validate_isbn_batch(isbns, corrections, MAX_VALIDATE_BATCH_SIZE))
+
 @app.route('/api/batch-generate', methods=['POST'])
 def api_batch_generate():
     """Generate multiple ISBNs with the same prefix"""
-    data = request.json
-    country_code = data.get('country_code', '3')
-    publisher_code = data.get('publisher_code', '16')
-    count = int(data.get('count', 10))
-    use_multiples = data.get('use_multiples', True)
-    
-    # Validate inputs
-    if not re.match(r'^\d$', country_code):
-        return jsonify({'error': 'Country code must be a single digit (0-9)'}), 400
-        
-    if not re.match(r'^\d{1,2}$', publisher_code):
-        return jsonify({'error': 'Publisher code must be 1-2 digits (0-99)'}), 400
-    
-    if count < 1 or count > 250:
-        return jsonify({'error': 'Count must be between 1 and 250'}), 400
-    
-    # Format the publisher code as a two-digit string
-    publisher_code = f"{int(publisher_code):02d}"
-    
-    # Form the prefix
-    prefix = f"978{country_code}{publisher_code}"
+    prefix, count, use_multiples, error = parse_batch_request(request.json, MAX_BATCH_SIZE)
+    if error:
+        return jsonify({'error': error}), 400
     
-    # Generate the ISBNs
-    isbns = []
-    for i in range(count):
-        isbn = generate_isbn(prefix=prefix, use_multiples=use_multiples, verbose=False)
-        if isbn:
-            isbns.append(isbn)
-        else:
-            # Couldn't generate any more ISBNs
-            break
+    # Generate the ISBNs in a single pass, stopping early if the prefix runs out
+    isbns = generate_isbns(prefix=prefix, count=count, use_multiples=use_multiples, verbose=False)
     
     if not isbns:
         return jsonify({'error': 'Failed to generate any ISBNs'}), 400
@@ -123,17 +386,112 @@ def api_batch_generate():
         'prefix': prefix
     })
 
+@app.route('/api/batch-generate/stream', methods=['POST'])
+def api_batch_generate_stream():
+    """Generate multiple ISBNs with the same prefix, streaming them as they are stored"""
+    data = request.json
+    output_format = data.get('format', 'ndjson')
+    if output_format not in STREAM_FORMATS:
+        return jsonify({'error': 'Format must be "ndjson" or "csv"'}), 400
+    
+    prefix, count, use_multiples, error = parse_batch_request(data, MAX_JOB_SIZE)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # ISBNs are generated chunk by chunk while the response is sent
+    isbns = iter_generate_isbns(prefix=prefix, count=count, use_multiples=use_multiples)
+    rows = ({'isbn': isbn} for isbn in isbns)
+    return Response(stream_rows(rows, ['isbn'], output_format), mimetype=STREAM_FORMATS[output_format])
+
+@app.route('/api/export', methods=['GET'])
+def api_export():
+    """Stream every stored ISBN with its publisher code"""
+    output_format = request.args.get('format', 'ndjson')
+    if output_format not in STREAM_FORMATS:
+        return jsonify({'error': 'Format must be "ndjson" or "csv"'}), 400
+    
+    rows = ({'publisher_code': publisher_code, 'isbn': isbn} for publisher_code, isbn in get_storage().iter_isbns())
+    response = Response(stream_rows(rows, ['publisher_code', 'isbn'], output_format), mimetype=STREAM_FORMATS[output_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=isbns.{output_format}'
+    return response
+
+@app.route('/api/batch-jobs', methods=['POST'])
+def api_create_batch_job():
+    """Start generating multiple ISBNs with the same prefix in the background"""
+    prefix, count, use_multiples, error = parse_batch_request(request.json, MAX_JOB_SIZE)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # Queue the job and return immediately
+    job = job_manager.submit(prefix, count, use_multiples)
+    response = job.to_dict()
+    response['status_url'] = f"/api/batch-jobs/{job.id}"
+    response['isbns_url'] = f"/api/batch-jobs/{job.id}/isbns"
+    return jsonify(response), 202
+
+@app.route('/api/batch-jobs/<job_id>', methods=['GET'])
+def api_batch_job_status(job_id):
+    """Get the progress of a batch generation job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/batch-jobs/<job_id>', methods=['DELETE'])
+def api_cancel_batch_job(job_id):
+    """Cancel a batch generation job; ISBNs generated so far are kept"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.cancel()
+    return jsonify(job.to_dict())
+
+@app.route('/api/batch-jobs/<job_id>/isbns', methods=['GET'])
+def api_batch_job_isbns(job_id):
+    """Get a page of the ISBNs a batch generation job has generated so far"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', 1000, type=int)
+    if offset < 0 or limit < 1 or limit > MAX_JOB_PAGE_SIZE:
+        return jsonify({'error': f'Offset must not be negative and limit must be between 1 and {MAX_JOB_PAGE_SIZE}'}), 400
+    
+    # Read the length first, so the page only holds ISBNs that are already complete
+    generated = len(job.isbns)
+    isbns = job.isbns[offset:min(offset + limit, generated)]
+    next_offset = offset + len(isbns)
+    return jsonify({
+        'isbns': isbns,
+        'offset': offset,
+        'next_offset': next_offset if next_offset < generated or not job.finished else None,
+        'generated': generated,
+        'status': job.status
+    })
+
 @app.route('/api/isbn-count', methods=['GET'])
 def api_isbn_count():
     """Get the total number of ISBNs in storage"""
     return jsonify({
-        'count': isbn_storage.count_isbns()
+        'count': get_storage().count_isbns()
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """Expose the counters and latency histograms in the Prometheus text format"""
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled, set ISBN_METRICS=1 to enable them'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def not_found(e):
     return jsonify({'error': 'Not found'}), 404
 
+@app.errorhandler(413)
+def too_large(e):
+    return jsonify({'error': f'Too many ISBNs, send at most {MAX_VALIDATE_BATCH_SIZE} in {MAX_VALIDATE_BODY_BYTES} bytes'}), 413
+
 @app.errorhandler(500)
 def server_error(e):
     return jsonify({'error': 'Server error'}), 500
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import isbn13_crt
+from isbn13_crt import (
+    ISBNStorage, get_prefix_slots, generate_isbn, generate_isbns, check_isbn,
+    cached_check_isbn, fast_check_isbn, check_isbns_array, ValidationCache
+)
+
+# Store sizes (number of ISBNs) used for the storage and generation benchmarks
+DEFAULT_SIZES = (10000, 100000, 1000000)
+QUICK_SIZES = (1000, 10000)
+
+# Number of timed calls per latency measurement
+DEFAULT_ROUNDS = 200
+
+# Prefix that the store fill never uses, so generation always has free slots
+BENCHMARK_PREFIX = "979999"
+
+def summarize(durations):
+    """
+    Summarize the durations of repeated calls.
+    
+    Parameters:
+    - durations: A list of durations in seconds
+    
+    Returns a dictionary with the count, mean, median, 95th percentile and minimum in
+    milliseconds, and the calls per second.
+    """
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        'calls': len(ordered),
+        'mean_ms': total / len(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'min_ms': ordered[0] * 1000,
+        'ops_per_sec': len(ordered) / total if total else None
+    }
+
+def time_calls(function, arguments):
+    """Call a function once per argument and return the list of durations."""
+    durations = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def iter_fill_prefixes():
+    """Yield the prefixes used to fill benchmark stores, in order."""
+    for gs1 in ("978", "979"):
+        for code in range(1000):
+            prefix = f"{gs1}{code:03d}"
+            if prefix != BENCHMARK_PREFIX:
+                yield prefix
+
+def build_store(storage_file, size):
+    """
+    Create a JSON store holding 'size' valid ISBNs, written as a compacted snapshot.
+    
+    Parameters:
+    - storage_file: The storage file to create
+    - size: The number of ISBNs to store
+    
+    Returns the number of ISBNs stored.
+    """
+    storage = ISBNStorage(storage_file, compact_every=size + 1)
+    stored = 0
+    for prefix in iter_fill_prefixes():
+        if stored >= size:
+            break
+        slots = get_prefix_slots(prefix)
+        count = min(len(slots), size - stored)
+        storage.add_isbns([(slots.publisher_code, slots.isbn(slot), prefix, slot) for slot in range(count)])
+        stored += count
+    storage.compact()
+    return stored
+
+def bench_storage(work_dir, size):
+    """Measure building, loading and saving a JSON store of the given size."""
+    storage_file = os.path.join(work_dir, f"store_{size}.json")
+    
+    start = time.perf_counter()
+    build_store(storage_file, size)
+    build_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    storage = ISBNStorage(storage_file)
+    load_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    storage.compact()
+    save_seconds = time.perf_counter() - start
+    
+    return storage_file, {
+        'isbns': storage.count_isbns(),
+        'file_bytes': os.path.getsize(storage_file),
+        'build_seconds': build_seconds,
+        'load_seconds': load_seconds,
+        'save_seconds': save_seconds
+    }
+
+def bench_generation(storage_file, rounds):
+    """Measure single-ISBN generation latency against an existing store."""
+    results = {}
+    for use_multiples in (True, False):
+        # Work on a copy, so every measurement starts from the same store
+        copy_file = f"{storage_file}.gen"
+        shutil.copyfile(storage_file, copy_file)
+        storage = ISBNStorage(copy_file, compact_every=rounds + 1)
+        capacity = len(get_prefix_slots(BENCHMARK_PREFIX))
+        
+        durations = time_calls(
+            lambda i: generate_isbn(prefix=BENCHMARK_PREFIX, verbose=False, use_multiples=use_multiples, storage=storage),
+            range(min(rounds, capacity))
+        )
+        results['multiples' if use_multiples else 'offsets'] = summarize(durations)
+        
+        for path in (copy_file, f"{copy_file}.log", f"{copy_file}.lock"):
+            if os.path.exists(path):
+                os.remove(path)
+    return results
+
+def bench_batch(work_dir, prefixes):
+    """Measure batch generation throughput by filling whole prefixes with generate_isbns."""
+    storage = ISBNStorage(os.path.join(work_dir, "batch.json"), compact_every=10**9)
+    durations = []
+    generated = 0
+    for prefix in prefixes:
+        start = time.perf_counter()
+        generated += len(generate_isbns(prefix=prefix, count=len(get_prefix_slots(prefix)), use_multiples=False, storage=storage))
+        durations.append(time.perf_counter() - start)
+    
+    total = sum(durations)
+    return {
+        'batches': len(durations),
+        'isbns': generated,
+        'seconds': total,
+        'isbns_per_sec': generated / total if total else None
+    }
+
+def make_validation_inputs(count):
+    """Return a mix of valid and invalid ISBN strings for the validation benchmarks."""
+    slots = get_prefix_slots("978316")
+    isbns = []
+    for i in range(count):
+        isbn = slots.isbn(i % len(slots))
+        # Make every other ISBN invalid by changing its last digit
+        if i % 2:
+            isbn = isbn[:-1] + str((int(isbn[-1]) + 1) % 10)
+        isbns.append(isbn)
+    return isbns
+
+def bench_validation(work_dir, count):
+    """Measure check_isbn, the fast path, the cached check and vectorized checks."""
+    storage = ISBNStorage(os.path.join(work_dir, "validation.json"))
+    isbns = make_validation_inputs(count)
+    results = {
+        'check_isbn': summarize(time_calls(lambda isbn: check_isbn(isbn, verbose=False, storage=storage), isbns)),
+        'fast_check_isbn': summarize(time_calls(fast_check_isbn, [isbn.encode() for isbn in isbns]))
+    }
+    
+    # A small set of popular ISBNs, as seen by /api/validate
+    cache = isbn13_crt.validation_cache
+    isbn13_crt.validation_cache = ValidationCache()
+    try:
+        popular = isbns[:100] * (count // 100 or 1)
+        results['cached_check_isbn'] = summarize(
+            time_calls(lambda isbn: cached_check_isbn(isbn, storage=storage), popular)
+        )
+        results['cached_check_isbn']['cache'] = isbn13_crt.validation_cache.stats()
+    finally:
+        isbn13_crt.validation_cache = cache
+    
+    buffer = '\n'.join(isbns).encode()
+    for use_numpy in (False, True):
+        if use_numpy and isbn13_crt.np is None:
+            continue
+        start = time.perf_counter()
+        check_isbns_array(buffer, use_numpy=use_numpy)
+        seconds = time.perf_counter() - start
+        results['check_isbns_array_numpy' if use_numpy else 'check_isbns_array'] = {
+            'isbns': count,
+            'seconds': seconds,
+            'isbns_per_sec': count / seconds if seconds else None
+        }
+    return results
+
+def bench_flask(work_dir, rounds):
+    """Measure endpoint latency through the Flask test client."""
+    try:
+        from app import app
+    except ImportError as e:
+        return {'skipped': f"Flask is not available: {e}"}
+    
+    previous = isbn13_crt.get_storage() if 'isbn_storage' in vars(isbn13_crt) else None
+    isbn13_crt.set_storage(ISBNStorage(os.path.join(work_dir, "flask.json"), compact_every=10**9))
+    client = app.test_client()
+    try:
+        isbns = make_validation_inputs(rounds)
+        publisher_codes = [f"{i % 100:02d}" for i in range(rounds)]
+        return {
+            'generate': summarize(time_calls(
+                lambda code: client.post('/api/generate', json={'country_code': '5', 'publisher_code': code}), publisher_codes
+            )),
+            'validate': summarize(time_calls(
+                lambda isbn: client.post('/api/validate', json={'isbn': isbn}), isbns
+            )),
+            'batch_generate_100': summarize(time_calls(
+                lambda code: client.post('/api/batch-generate', json={'country_code': '6', 'publisher_code': code, 'count': 100}),
+                publisher_codes[:min(rounds, 50)]
+            )),
+            'validate_batch_10000': summarize(time_calls(
+                lambda body: client.post('/api/validate-batch', data=body, content_type='text/plain'),
+                ['\n'.join(make_validation_inputs(10000)).encode()] * 5
+            ))
+        }
+    finally:
+        isbn13_crt.set_storage(previous)
+
+def run_benchmarks(sizes=DEFAULT_SIZES, rounds=DEFAULT_ROUNDS, work_dir=None):
+    """
+    Run every benchmark on temporary stores.
+    
+    Parameters:
+    - sizes: The store sizes (numbers of ISBNs) to measure storage and generation at
+    - rounds: The number of timed calls per latency measurement
+    - work_dir: Directory for the temporary stores (default: a new temporary directory)
+    
+    Returns the results as a JSON-serializable dictionary.
+    """
+    own_dir = work_dir is None
+    if own_dir:
+        work_dir = tempfile.mkdtemp(prefix="isbn13_bench_")
+    
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'numpy': isbn13_crt.np is not None,
+            'sizes': list(sizes),
+            'rounds': rounds
+        },
+        'storage': {},
+        'generate_isbn': {}
+    }
+    try:
+        for size in sizes:
+            print(f"Store with {size} ISBNs...", file=sys.stderr)
+            storage_file, results['storage'][str(size)] = bench_storage(work_dir, size)
+            results['generate_isbn'][str(size)] = bench_generation(storage_file, rounds)
+            os.remove(storage_file)
+        
+        print("Batch generation...", file=sys.stderr)
+        results['generate_isbns'] = bench_batch(work_dir, [f"978{code:03d}" for code in range(max(1, rounds // 10))])
+        
+        print("Validation...", file=sys.stderr)
+        results['validation'] = bench_validation(work_dir, rounds * 50)
+        
+        print("Flask endpoints...", file=sys.stderr)
+        results['flask'] = bench_flask(work_dir, rounds)
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def iter_metrics(results, path=()):
+    """Yield (name, value) for every timing or throughput figure in a results dictionary."""
+    for key, value in results.items():
+        if key == 'meta':
+            continue
+        if isinstance(value, dict):
+            yield from iter_metrics(value, path + (key,))
+        elif isinstance(value, (int, float)) and key.endswith(('_ms', 'seconds', '_per_sec')):
+            yield '.'.join(path + (key,)), value
+
+def compare_results(previous, current, threshold=0.1):
+    """
+    Compare two benchmark results.
+    
+    Parameters:
+    - previous: The results of an earlier run
+    - current: The results of this run
+    - threshold: Relative change above which a figure is reported as a regression
+    
+    Returns a list of (name, previous, current, relative_change, regressed) tuples. For
+    throughput figures (per second) lower is worse, for all others higher is worse.
+    """
+    previous_metrics = dict(iter_metrics(previous))
+    comparison = []
+    for name, value in iter_metrics(current):
+        old = previous_metrics.get(name)
+        if not old or value is None:
+            continue
+        change = (value - old) / old
+        worse = -change if name.endswith('_per_sec') else change
+        comparison.append((name, old, value, change, worse > threshold))
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ISBN generation, validation and storage.")
+    parser.add_argument("--output", default="-", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--sizes", help="comma-separated store sizes (default: 10000,100000,1000000)")
+    parser.add_argument("--quick", action="store_true", help="use small stores (1000,10000) for a fast run")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help=f"timed calls per measurement (default: {DEFAULT_ROUNDS})")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression (default: 0.1)")
+    args = parser.parse_args()
+    
+    if args.sizes:
+        sizes = [int(size) for size in args.sizes.split(",")]
+    else:
+        sizes = QUICK_SIZES if args.quick else DEFAULT_SIZES
+    
+    results = run_benchmarks(sizes, args.rounds)
+    
+    output = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = 0
+        for name, old, new, change, regressed in compare_results(previous, results, args.threshold):
+            marker = "REGRESSION" if regressed else ""
+            print(f"{name}: {old:.4g} -> {new:.4g} ({change:+.1%}) {marker}", file=sys.stderr)
+            regressions += regressed
+        sys.exit(1 if regressions else 0)
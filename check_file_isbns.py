@@ -1,51 +1,294 @@
 #!/usr/bin/env python3
+import argparse
+import csv
+import gzip
+import io
+import json
+import mmap
+import os
 import re
 import sys
-from isbn13_crt import check_isbn
+from concurrent.futures import ProcessPoolExecutor
+from isbn13_crt import check_isbns_array, DEFAULT_SCHEME
+from isbn_profiling import profiling, PROFILE_MODE, PROFILE_MODES, PROFILE_DIR
 
-def check_file_isbns(filename):
+# Matches lines like "1. 9783160001071 (Format: 978-3-16-0001071)" as well as bare 13-digit ISBNs
+ISBN_LINE_PATTERN = re.compile(rb'^(?:\d+\.\s+)?(\d{13})(?:\s|$)')
+
+# Number of ISBNs validated together in one check_isbns_array call
+BATCH_SIZE = 65536
+
+# Size of the read buffer used when streaming the input file
+READ_BUFFER_SIZE = 1 << 20
+
+# Size of the pieces a worker reads from its shard of a memory-mapped file
+SHARD_CHUNK_SIZE = 16 << 20
+
+# Number of shards per worker, so workers that finish early can pick up more work
+SHARDS_PER_WORKER = 4
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+def open_isbn_file(filename):
     """
-    Verify all ISBNs in a file follow the CRT rules
+    Open an ISBN file for streaming binary reads.
+    
+    Parameters:
+    - filename: The file to read, or "-" for standard input. Gzip compressed input is
+                detected from its magic bytes.
+    
+    Returns a binary stream that can be iterated line by line.
     """
-    print(f"Checking ISBNs in file: {filename}")
+    if filename == '-':
+        stream = io.BufferedReader(sys.stdin.buffer, READ_BUFFER_SIZE)
+    else:
+        stream = open(filename, 'rb', buffering=READ_BUFFER_SIZE)
     
-    # Read the file
-    with open(filename, 'r') as f:
-        lines = f.readlines()
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = io.BufferedReader(gzip.GzipFile(fileobj=stream), READ_BUFFER_SIZE)
+    return stream
+
+def iter_isbn_lines(lines, first_line_number=1):
+    """
+    Extract ISBNs from lines of a file.
     
-    # Extract ISBNs
-    isbns = []
-    for line in lines:
-        # Match lines like "1. 9783160001071 (Format: 978-3-16-0001071)"
-        if re.match(r'^\d+\.\s+\d{13}\s+\(Format:', line):
-            isbn = line.split('. ')[1].split(' ')[0]
-            isbns.append(isbn)
+    Parameters:
+    - lines: An iterable of lines as bytes
+    - first_line_number: The line number of the first line
     
-    print(f"Found {len(isbns)} ISBNs in the file")
+    Yields (line_number, isbn) tuples, with the ISBN as 13 ASCII digit bytes.
+    """
+    match = ISBN_LINE_PATTERN.match
+    for line_number, line in enumerate(lines, first_line_number):
+        found = match(line)
+        if found:
+            yield line_number, found.group(1)
+
+def find_invalid_isbns(records, on_invalid, batch_size=BATCH_SIZE):
+    """
+    Validate ISBN records in batches.
     
-    # Check each ISBN
-    invalid_count = 0
+    Parameters:
+    - records: An iterable of (line_number, isbn) tuples as produced by iter_isbn_lines
+    - on_invalid: Called with a (line_number, isbn, publisher_code, expected_remainders, actual_remainders)
+                  tuple for every ISBN that does not follow the CRT rules
+    - batch_size: Number of ISBNs to validate at once
     
-    for i, isbn in enumerate(isbns, 1):
-        is_valid, info = check_isbn(isbn, verbose=False)
-        
+    Returns the number of ISBNs that were checked.
+    """
+    checked = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            checked += _check_batch(batch, on_invalid)
+            batch = []
+    if batch:
+        checked += _check_batch(batch, on_invalid)
+    return checked
+
+def _check_batch(batch, on_invalid):
+    """Validate one batch of records and report its invalid ISBNs."""
+    buffer = b'\n'.join(isbn for _, isbn in batch)
+    valid, expected, actual = check_isbns_array(buffer, record_size=14)
+    if hasattr(valid, 'tolist'):
+        valid = valid.tolist()
+    
+    for i, is_valid in enumerate(valid):
         if not is_valid:
-            invalid_count += 1
-            print(f"ISBN #{i} is INVALID: {isbn}")
-            print(f"  Publisher code: {info['publisher_code']}")
-            print(f"  Expected remainders: {info['expected_remainders']}")
-            print(f"  Actual remainders: {info['actual_remainders']}")
+            line_number, isbn = batch[i]
+            isbn = isbn.decode('ascii')
+            on_invalid((line_number, isbn, DEFAULT_SCHEME.publisher_code(isbn), [int(r) for r in expected[i]], [int(r) for r in actual[i]]))
+    return len(batch)
+
+def split_file_shards(filename, shard_count):
+    """
+    Split a file into byte ranges that start and end on line boundaries.
+    
+    Parameters:
+    - filename: The file to split
+    - shard_count: The number of shards to aim for
+    
+    Returns a list of (start, end) byte offsets covering the whole file.
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+    
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        shards = []
+        start = 0
+        for i in range(1, shard_count + 1):
+            # Move each boundary forward to just after the next newline
+            end = mapped.find(b'\n', max(start, size * i // shard_count - 1)) + 1
+            if i == shard_count or end == 0:
+                end = size
+            if end > start:
+                shards.append((start, end))
+                start = end
+            if start == size:
+                break
+        return shards
+
+def check_file_shard(filename, start, end, batch_size=BATCH_SIZE):
+    """
+    Validate the ISBNs in one shard of a file; runs inside a worker process.
+    
+    The file is memory-mapped and read in line-aligned chunks, so only the invalid
+    rows are sent back to the parent process.
+    
+    Parameters:
+    - filename: The file to check
+    - start: Byte offset of the first line of the shard
+    - end: Byte offset just past the last line of the shard
+    - batch_size: Number of ISBNs to validate at once
+    
+    Returns a tuple (line_count, checked, invalid_rows), with the line numbers in the rows
+    counted from the start of the shard.
+    """
+    invalid_rows = []
+    line_count = 0
+    checked = 0
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        position = start
+        while position < end:
+            chunk_end = min(end, position + SHARD_CHUNK_SIZE)
+            if chunk_end < end:
+                chunk_end = mapped.find(b'\n', chunk_end - 1, end) + 1 or end
+            
+            lines = mapped[position:chunk_end].split(b'\n')
+            if lines[-1] == b'':
+                lines.pop()
+            checked += find_invalid_isbns(iter_isbn_lines(lines, line_count + 1), invalid_rows.append, batch_size)
+            line_count += len(lines)
+            position = chunk_end
+    return line_count, checked, invalid_rows
+
+def find_invalid_isbns_parallel(filename, on_invalid, workers, batch_size=BATCH_SIZE):
+    """
+    Validate the ISBNs of a file in a pool of worker processes.
+    
+    Parameters:
+    - filename: The file to check (must be a regular, uncompressed file)
+    - on_invalid: Called for every invalid ISBN row, in input order
+    - workers: The number of worker processes
+    - batch_size: Number of ISBNs to validate at once
+    
+    Returns the number of ISBNs that were checked.
+    """
+    shards = split_file_shards(filename, workers * SHARDS_PER_WORKER)
+    checked = 0
+    lines_before = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(check_file_shard, filename, start, end, batch_size) for start, end in shards]
+        
+        # Collect the shards in order, turning shard line numbers into file line numbers
+        for future in futures:
+            line_count, shard_checked, invalid_rows = future.result()
+            for row in invalid_rows:
+                on_invalid((row[0] + lines_before,) + row[1:])
+            checked += shard_checked
+            lines_before += line_count
+    return checked
+
+def make_report_writer(stream, report_format):
+    """
+    Create a function that writes invalid ISBN rows to a report.
+    
+    Parameters:
+    - stream: The text stream to write the report to
+    - report_format: "csv" or "jsonl"
+    
+    Returns a function accepting the rows reported by find_invalid_isbns.
+    """
+    if report_format == 'jsonl':
+        def write_row(row):
+            line_number, isbn, publisher_code, expected, actual = row
+            stream.write(json.dumps({
+                'line': line_number,
+                'isbn': isbn,
+                'publisher_code': publisher_code,
+                'expected_remainders': expected,
+                'actual_remainders': actual
+            }) + '\n')
+        return write_row
+    
+    writer = csv.writer(stream)
+    writer.writerow(['line', 'isbn', 'publisher_code', 'expected_remainders', 'actual_remainders'])
+    
+    def write_row(row):
+        line_number, isbn, publisher_code, expected, actual = row
+        writer.writerow([line_number, isbn, publisher_code, ' '.join(map(str, expected)), ' '.join(map(str, actual))])
+    return write_row
+
+def check_file_isbns(filename, report='-', report_format=None, summary_only=False, batch_size=BATCH_SIZE, workers=1):
+    """
+    Verify all ISBNs in a file follow the CRT rules
+    
+    Parameters:
+    - filename: The file to check, or "-" for standard input (may be gzip compressed)
+    - report: Where to write the report of invalid ISBNs, "-" for standard output
+    - report_format: "csv" or "jsonl" (default: from the report file extension, otherwise csv)
+    - summary_only: Only count the invalid ISBNs instead of writing a report
+    - batch_size: Number of ISBNs to validate at once
+    - workers: Number of worker processes; stdin and gzip input are always checked in a single process
+    
+    Returns a dictionary with the number of checked and invalid ISBNs.
+    """
+    if report_format is None:
+        report_format = 'jsonl' if report.endswith(('.jsonl', '.ndjson')) else 'csv'
+    
+    # Keep the summary off stdout when the report is written there
+    summary_stream = sys.stderr if report == '-' and not summary_only else sys.stdout
+    print(f"Checking ISBNs in file: {filename}", file=summary_stream)
+    
+    invalid_count = 0
+    report_stream = None
+    if not summary_only:
+        report_stream = sys.stdout if report == '-' else open(report, 'w', newline='')
+        write_row = make_report_writer(report_stream, report_format)
+    
+    def on_invalid(row):
+        nonlocal invalid_count
+        invalid_count += 1
+        if not summary_only:
+            write_row(row)
+    
+    try:
+        with open_isbn_file(filename) as stream:
+            parallel = workers > 1 and filename != '-' and stream.peek(2)[:2] != GZIP_MAGIC
+            if not parallel:
+                checked = find_invalid_isbns(iter_isbn_lines(stream), on_invalid, batch_size)
+        if parallel:
+            checked = find_invalid_isbns_parallel(filename, on_invalid, workers, batch_size)
+    finally:
+        if report_stream is not None and report_stream is not sys.stdout:
+            report_stream.close()
     
     # Summary
     if invalid_count == 0:
-        print(f"All {len(isbns)} ISBNs follow the Chinese Remainder Theorem rules!")
+        print(f"All {checked} ISBNs follow the Chinese Remainder Theorem rules!", file=summary_stream)
     else:
-        print(f"Found {invalid_count} invalid ISBNs out of {len(isbns)}")
+        print(f"Found {invalid_count} invalid ISBNs out of {checked}", file=summary_stream)
+    
+    return {'checked': checked, 'invalid': invalid_count}
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Please provide the filename to check")
-        print("Usage: python check_file_isbns.py filename.txt")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Verify that the ISBNs in a file follow the CRT rules.")
+    parser.add_argument("filename", help="file to check, one ISBN per line (use - for stdin, gzip input is detected)")
+    parser.add_argument("--report", default="-", help="file to write invalid ISBNs to (default: stdout)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="report format (default: from the report extension, otherwise csv)")
+    parser.add_argument("--summary-only", action="store_true", help="only print the number of invalid ISBNs")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"ISBNs validated per batch (default: {BATCH_SIZE})")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--profile", nargs="?", const="cpu", default=PROFILE_MODE, choices=PROFILE_MODES,
+                        help="profile the check with cProfile (cpu, the default) or tracemalloc (memory); "
+                             "worker processes are not profiled")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help=f"directory for profile dumps (default: {PROFILE_DIR})")
+    args = parser.parse_args()
     
-    check_file_isbns(sys.argv[1]) 
\ No newline at end of file
+    with profiling("check_file_isbns", args.profile, args.profile_dir) as profile_result:
+        summary = check_file_isbns(args.filename, args.report, args.format, args.summary_only, args.batch_size, args.workers)
+    if profile_result:
+        print(f"Profile written to {', '.join(profile_result.paths)}", file=sys.stderr)
+    sys.exit(1 if summary['invalid'] else 0)
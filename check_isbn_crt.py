@@ -1,35 +1,22 @@
 #!/usr/bin/env python3
+from isbn13_crt import fast_check_isbn, DEFAULT_SCHEME
 
 def check_isbn_crt(isbn):
     """Check if ISBN follows the Chinese Remainder Theorem conditions"""
-    # Extract publisher code (positions 4-5)
-    publisher_code = int(isbn[4:6])
-    full_num = int(isbn)
+    # Validate on the fast path, which also yields the publisher code and the residue of the full ISBN
+    is_valid, publisher_code, residue = fast_check_isbn(isbn)
     
-    # Calculate remainders for publisher code
-    pub_r3 = publisher_code % 3
-    pub_r5 = publisher_code % 5
-    pub_r7 = publisher_code % 7
-    pub_r11 = publisher_code % 11
-    pub_r13 = publisher_code % 13
-    
-    # Calculate remainders for full ISBN
-    isbn_r3 = full_num % 3
-    isbn_r5 = full_num % 5
-    isbn_r7 = full_num % 7
-    isbn_r11 = full_num % 11
-    isbn_r13 = full_num % 13
-    
-    # Check if the remainders match
-    is_valid = (pub_r3 == isbn_r3 and pub_r5 == isbn_r5 and pub_r7 == isbn_r7 and pub_r11 == isbn_r11 and pub_r13 == isbn_r13)
-    
-    return {
+    result = {
         'isbn': isbn,
         'publisher_code': publisher_code,
-        'pub_remainders': [pub_r3, pub_r5, pub_r7, pub_r11, pub_r13],
-        'isbn_remainders': [isbn_r3, isbn_r5, isbn_r7, isbn_r11, isbn_r13],
         'is_valid': is_valid
     }
+    
+    # Only invalid ISBNs are reported with their remainders
+    if not is_valid and publisher_code is not None:
+        result['pub_remainders'] = [publisher_code % m for m in DEFAULT_SCHEME.moduli]
+        result['isbn_remainders'] = [residue % m for m in DEFAULT_SCHEME.moduli]
+    return result
 
 # Read ISBNs from the file
 with open('isbn13_978316_100.txt', 'r') as f:
@@ -50,9 +37,13 @@ for i, isbn in enumerate(isbns, 1):
     if not result['is_valid']:
         invalid_count += 1
         print(f"ISBN #{i} is INVALID: {isbn}")
-        print(f"  Publisher code: {result['publisher_code']}")
-        print(f"  Publisher remainders (mod 3,5,7,11,13): {result['pub_remainders']}")
-        print(f"  ISBN remainders (mod 3,5,7,11,13): {result['isbn_remainders']}")
+        if result['publisher_code'] is None:
+            print("  Not a 13-digit ISBN")
+        else:
+            print(f"  Publisher code: {result['publisher_code']}")
+            moduli = ','.join(map(str, DEFAULT_SCHEME.moduli))
+            print(f"  Publisher remainders (mod {moduli}): {result['pub_remainders']}")
+            print(f"  ISBN remainders (mod {moduli}): {result['isbn_remainders']}")
         print()
 
 # Print summary
@@ -2,22 +2,289 @@
 import os
 import sys
 import json
+import math
 import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Sequence
+from contextlib import contextmanager
+from functools import lru_cache
+from isbn_metrics import (
+    registry as metrics, ISBNS_ISSUED, SLOT_COLLISIONS, MULTIPLE_ATTEMPTS, OFFSET_FALLBACKS, PREFIXES_EXHAUSTED,
+    VALIDATIONS, STAGE_SECONDS
+)
 
-# File to store generated ISBNs
-ISBN_STORAGE_FILE = "generated_isbns.json"
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, storage is then only locked within a process
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, check_isbns_array falls back to pure Python
+    np = None
+
+# File to store generated ISBNs; its extension selects the storage backend (see open_storage)
+ISBN_STORAGE_FILE = os.environ.get("ISBN_STORAGE_FILE", "generated_isbns.json")
+
+# Extension of memory-mapped slot bitmap storage files (see isbn_mmap_storage.py)
+MMAP_STORAGE_SUFFIX = ".isbnmap"
+
+# Extensions of SQLite storage files (see isbn_sqlite_storage.py)
+SQLITE_STORAGE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+# Moduli used by the CRT conditions of the default scheme; ISBN_CRT_MODULI overrides them (e.g. "7,11,13")
+CRT_MODULI = tuple(int(m) for m in os.environ.get("ISBN_CRT_MODULI", "3,5,7,11,13").split(","))
+
+# Product of the CRT moduli (15015 for 3 * 5 * 7 * 11 * 13); valid book numbers for a prefix repeat with this period
+CRT_MODULUS = math.prod(CRT_MODULI)
+
+# Book numbers are the last 7 digits of the ISBN
+BOOK_NUMBER_LIMIT = 10**7
+
+# Largest number of ISBNs that can be requested in one batch
+MAX_BATCH_SIZE = 100000
+
+# Number of journal records appended before the journal is compacted into the snapshot
+JOURNAL_COMPACT_EVERY = 1000
+
+# Number of check_isbn results kept by cached_check_isbn; 0 disables the cache
+VALIDATION_CACHE_SIZE = int(os.environ.get("ISBN_VALIDATION_CACHE_SIZE", "65536"))
+
+class ISBNList(Sequence):
+    """
+    Compact, append-only list of 13-digit ISBNs.
+    
+    The ISBNs are kept as integers in an array('Q'), 8 bytes each instead of a string
+    object per ISBN, and are turned back into strings as they are read, so the list can
+    be used wherever a list of ISBN strings is expected. The ISBNs are in insertion
+    order, so "in" scans the whole list; ISBNStorage.is_isbn_generated looks them up
+    in the sorted per-prefix index instead.
+    """
+    __slots__ = ('integers', '_padded')
+    
+    def __init__(self, isbns=()):
+        self.integers = array('Q', map(int, isbns))
+        # Whether any ISBN starts with 0 and needs padding back to 13 digits
+        self._padded = bool(self.integers) and min(self.integers) < 10**12
+    
+    def __len__(self):
+        return len(self.integers)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [f"{value:013d}" for value in self.integers[index]]
+        return f"{self.integers[index]:013d}"
+    
+    def __iter__(self):
+        if self._padded:
+            return (f"{value:013d}" for value in self.integers)
+        # Without padding, str() is the quickest conversion, which matters when saving snapshots
+        return map(str, self.integers)
+    
+    def __eq__(self, other):
+        if isinstance(other, ISBNList):
+            return self.integers == other.integers
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+    
+    def __repr__(self):
+        return f"ISBNList({list(self)!r})"
+    
+    def append(self, isbn):
+        """Add an ISBN (string or integer) to the end of the list."""
+        value = int(isbn)
+        self.integers.append(value)
+        if value < 10**12:
+            self._padded = True
+    
+    def extend(self, isbns):
+        """Add ISBNs (strings or integers) to the end of the list in a single step."""
+        values = array('Q', map(int, isbns))
+        if values and min(values) < 10**12:
+            self._padded = True
+        self.integers.extend(values)
 
 class ISBNStorage:
     """
     Class to handle storage and retrieval of generated ISBNs.
     Ensures that no ISBN is generated twice.
+    
+    By default new ISBNs are appended as single records to a journal file
+    (the storage file name with a ".log" suffix) instead of rewriting the whole
+    storage file on every addition. The journal is periodically compacted into
+    the JSON snapshot, and both are replayed when the storage is loaded.
+    
+    Alongside the ISBN lists, the snapshot keeps a SlotAllocator bitmap per prefix
+    recording which valid book number slots have been used, and the book number of
+    the most recently added ISBN of each prefix.
+    
+    In memory, each publisher's ISBNs are held in an ISBNList, and membership checks
+    binary search a sorted array of the book numbers stored under each prefix, so no
+    string object is kept per stored ISBN.
+    
+    Several threads and processes can share one storage file as long as they
+    allocate and store ISBNs inside transaction(), which holds a lock file and
+    first catches up with the records other processes have written.
+    
+    The storage's scheme (see ISBNScheme) defines the slots its allocators track
+    and is the scheme ISBNs are generated with.
     """
-    def __init__(self, storage_file=ISBN_STORAGE_FILE):
+    def __init__(self, storage_file=ISBN_STORAGE_FILE, use_journal=True, compact_every=JOURNAL_COMPACT_EVERY, scheme=None):
         self.storage_file = storage_file
-        self.data = self._load_data()
+        self.scheme = scheme or DEFAULT_SCHEME
+        self.journal_file = f"{storage_file}.log"
+        self.lock_file = f"{storage_file}.lock"
+        self.use_journal = use_journal
+        self.compact_every = compact_every
+        self._journal_records = 0
+        self._lock = threading.RLock()
+        self._lock_handle = None
+        self._transaction_depth = 0
+        self._add_listeners = []
+        # Book numbers of up to 9 digits fit in 4 bytes
+        self._book_number_type = 'I' if self.scheme.book_number_limit <= 2**32 else 'Q'
+        self._reload()
+    
+    def _reload(self):
+        """Load the snapshot and journal into memory, replacing the current contents."""
+        with STAGE_SECONDS.time('storage_load'):
+            self._snapshot_signature = self._get_snapshot_signature()
+            self.data = self._load_data()
+            self._index = self._build_index(self.data)
+    
+    def _get_snapshot_signature(self):
+        """Return a value that changes whenever the snapshot file is replaced."""
+        try:
+            stat = os.stat(self.storage_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the storage lock while allocating and storing ISBNs.
+        
+        The lock is held against other threads and, through a lock file, against other
+        processes using the same storage file. On entry, the storage catches up with any
+        ISBNs that other processes have stored, so slots reserved from its allocators
+        inside the transaction are guaranteed to be unused. Transactions can be nested.
+        """
+        with self._lock:
+            if self._transaction_depth == 0:
+                self._lock_handle = open(self.lock_file, 'a')
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+                    self._refresh()
+                except BaseException:
+                    self._lock_handle.close()
+                    raise
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    # Closing the lock file releases the lock
+                    self._lock_handle.close()
+                    self._lock_handle = None
+    
+    def _refresh_for_read(self):
+        """
+        Catch up with the ISBNs other processes have written before answering a read.
+        
+        Checking for changes takes two stat calls; only when the snapshot or the journal
+        has changed is the storage refreshed, under a shared lock so that a concurrent
+        compaction is never seen half done.
+        """
+        if not self._is_stale():
+            return
+        with self._lock:
+            # Inside our own transaction the storage is already up to date
+            if self._transaction_depth:
+                return
+            with open(self.lock_file, 'a') as lock_handle:
+                if fcntl is not None:
+                    fcntl.flock(lock_handle, fcntl.LOCK_SH)
+                self._refresh()
+    
+    def _is_stale(self):
+        """Return True if the snapshot or the journal changed since the storage last read them."""
+        if self._get_snapshot_signature() != self._snapshot_signature:
+            return True
+        try:
+            return os.stat(self.journal_file).st_size != self._journal_position
+        except FileNotFoundError:
+            return self._journal_position != 0
+    
+    def _refresh(self):
+        """Catch up with the ISBNs other processes have written since the storage was loaded."""
+        if self._get_snapshot_signature() != self._snapshot_signature:
+            # Another process compacted the journal into a new snapshot
+            self._reload()
+            self._notify_added(None)
+            return
+        
+        records, self._journal_position = self._replay_journal(self.data, self._journal_position)
+        for record in records:
+            self._index_isbn(record['isbn'])
+            self._mark_slot(record['isbn'])
+        self._journal_records += len(records)
+        if records:
+            self._notify_added([record['isbn'] for record in records])
     
     def _load_data(self):
-        """Load previously generated ISBNs and metadata from storage file."""
+        """Load previously generated ISBNs and metadata from the snapshot and replay the journal."""
+        data = self._load_snapshot()
+        data['isbns'] = {publisher_code: self._load_isbn_list(isbns) for publisher_code, isbns in data['isbns'].items()}
+        if 'last_book_numbers' not in data:
+            data['last_book_numbers'] = self._find_last_book_numbers(data)
+        
+        slot_bitmaps = data.pop('slot_bitmaps', None)
+        crt_moduli = data.pop('crt_moduli', [3, 5, 7, 11, 13])
+        if slot_bitmaps is not None and tuple(crt_moduli) == self.scheme.moduli:
+            self._allocators = {
+                prefix: SlotAllocator.from_hex(len(self.scheme.slots(prefix)), bitmap)
+                for prefix, bitmap in slot_bitmaps.items()
+            }
+        else:
+            # Snapshot written before slot bitmaps were stored, or with another scheme, derive them from the ISBNs
+            self._allocators = {}
+            for publisher_isbns in data['isbns'].values():
+                for isbn in publisher_isbns:
+                    self._mark_slot(isbn)
+        
+        journal, self._journal_position = self._replay_journal(data)
+        for record in journal:
+            self._mark_slot(record['isbn'])
+        self._journal_records = len(journal)
+        return data
+    
+    def _load_isbn_list(self, isbns):
+        """Turn a list of ISBNs from the snapshot into an ISBNList, skipping entries that are not 13-digit strings."""
+        valid = [isbn for isbn in isbns if isinstance(isbn, str) and len(isbn) == 13 and isbn.isascii() and isbn.isdigit()]
+        if len(valid) != len(isbns):
+            # Written by hand or by another tool; the rest of the storage is still usable
+            print(f"Warning: Skipping {len(isbns) - len(valid)} malformed ISBN(s) in {self.storage_file}.")
+        return ISBNList(valid)
+    
+    def _find_last_book_numbers(self, data):
+        """Derive the last book number of each prefix from a snapshot written before they were stored."""
+        prefix_length = self.scheme.prefix_length
+        last_book_numbers = {}
+        # ISBNs are appended to their publisher's list, so the last one of each prefix is the most recent
+        for publisher_isbns in data['isbns'].values():
+            for isbn in publisher_isbns:
+                last_book_numbers[isbn[:prefix_length]] = int(isbn[prefix_length:])
+        return last_book_numbers
+    
+    def _load_snapshot(self):
+        """Load the JSON snapshot of previously generated ISBNs and metadata."""
         if os.path.exists(self.storage_file):
             try:
                 with open(self.storage_file, 'r') as f:
@@ -34,10 +301,191 @@ class ISBNStorage:
                 return {'isbns': {}, 'prefix_offsets': {}}
         return {'isbns': {}, 'prefix_offsets': {}}
     
+    def _replay_journal(self, data, start=0):
+        """
+        Apply the records of the journal file on top of the loaded snapshot.
+        
+        Parameters:
+        - data: The snapshot data to update in place
+        - start: The byte position in the journal to start reading from
+        
+        Returns:
+        - A tuple (records, position) with the list of journal records that were replayed
+          and the position just past the last complete record
+        """
+        if not os.path.exists(self.journal_file):
+            return [], 0
+        
+        with open(self.journal_file, 'rb') as f:
+            f.seek(start)
+            content = f.read()
+        
+        # Only complete lines are replayed; a trailing partial line is a record still being written
+        complete = content.rfind(b'\n') + 1
+        replayed = []
+        for line in content[:complete].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A record cut short by a crash mid-append; everything before it is intact
+                print(f"Warning: Skipping a corrupt record in {self.journal_file}.")
+                continue
+            self._apply_isbn(data, record['publisher_code'], record['isbn'], record['prefix'], record['offset'])
+            replayed.append(record)
+        return replayed, start + complete
+    
     def _save_data(self):
-        """Save the current set of ISBNs and metadata to the storage file."""
-        with open(self.storage_file, 'w') as f:
-            json.dump(self.data, f, indent=2)
+        """
+        Save the current set of ISBNs and metadata to the storage file.
+        
+        The snapshot is written to a temporary file and renamed into place, so a
+        crash mid-write never leaves a truncated storage file. The journal records
+        folded into the snapshot are then discarded.
+        """
+        snapshot = dict(self.data)
+        snapshot['isbns'] = {publisher_code: list(isbns) for publisher_code, isbns in self.data['isbns'].items()}
+        snapshot['slot_bitmaps'] = {prefix: allocator.to_hex() for prefix, allocator in self._allocators.items()}
+        snapshot['crt_moduli'] = list(self.scheme.moduli)
+        
+        temp_file = f"{self.storage_file}.tmp"
+        with STAGE_SECONDS.time('storage_save'):
+            with open(temp_file, 'w') as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(temp_file, self.storage_file)
+        self._snapshot_signature = self._get_snapshot_signature()
+        
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._journal_records = 0
+        self._journal_position = 0
+    
+    def _append_journal(self, records):
+        """
+        Append ISBN records to the journal file, compacting it when it grows too long.
+        
+        Parameters:
+        - records: A list of journal record dictionaries
+        """
+        with STAGE_SECONDS.time('journal_append'), open(self.journal_file, 'ab') as f:
+            # Terminate a partial record left behind by a crashed writer so it cannot swallow ours
+            if f.tell() > self._journal_position:
+                f.write(b'\n')
+            f.write(''.join(json.dumps(record) + '\n' for record in records).encode())
+            f.flush()
+            self._journal_position = f.tell()
+        
+        self._journal_records += len(records)
+        if self._journal_records >= self.compact_every:
+            self.compact()
+    
+    def compact(self):
+        """Fold the journal into the storage file snapshot."""
+        self._save_data()
+    
+    def _build_index(self, data):
+        """
+        Build the membership index used by is_isbn_generated.
+        
+        Parameters:
+        - data: The loaded storage data
+        
+        Returns:
+        - A dictionary mapping each ISBN prefix to a sorted array of the book numbers
+          stored with that prefix
+        """
+        # Split the ISBN integers into prefix and book number without going through strings
+        book_number_limit = self.scheme.book_number_limit
+        book_numbers = {}
+        for publisher_isbns in data['isbns'].values():
+            for value in publisher_isbns.integers:
+                prefix, book_number = divmod(value, book_number_limit)
+                book_numbers.setdefault(prefix, set()).add(book_number)
+        
+        prefix_length = self.scheme.prefix_length
+        return {
+            f"{prefix:0{prefix_length}d}": array(self._book_number_type, sorted(numbers))
+            for prefix, numbers in book_numbers.items()
+        }
+    
+    def _index_isbn(self, isbn):
+        """Insert the book number of an ISBN into the sorted array of its prefix."""
+        prefix_length = self.scheme.prefix_length
+        prefix = isbn[:prefix_length]
+        book_numbers = self._index.get(prefix)
+        if book_numbers is None:
+            book_numbers = self._index[prefix] = array(self._book_number_type)
+        
+        book_number = int(isbn[prefix_length:])
+        position = bisect_left(book_numbers, book_number)
+        if position == len(book_numbers) or book_numbers[position] != book_number:
+            book_numbers.insert(position, book_number)
+    
+    def _mark_slot(self, isbn):
+        """Mark the book number slot of a stored ISBN as used in its prefix's allocator."""
+        prefix_length = self.scheme.prefix_length
+        prefix = isbn[:prefix_length]
+        slot = self.scheme.slots(prefix).slot_of(int(isbn[prefix_length:]))
+        if slot is not None:
+            self.get_slot_allocator(prefix).mark_used(slot)
+    
+    def get_slot_allocator(self, prefix):
+        """
+        Get the allocator tracking the used book number slots of a prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The SlotAllocator for the prefix
+        """
+        allocator = self._allocators.get(prefix)
+        if allocator is None:
+            allocator = self._allocators[prefix] = SlotAllocator(len(self.scheme.slots(prefix)))
+        return allocator
+    
+    def remaining_capacity(self, prefix):
+        """Return the number of ISBNs that can still be generated with a prefix."""
+        return self.get_slot_allocator(prefix).free_count
+    
+    @staticmethod
+    def _apply_isbn(data, publisher_code, isbn, prefix, offset):
+        """Record an ISBN, its offset and its book number in the given storage data."""
+        # Add ISBN to the publisher code's list
+        if publisher_code not in data['isbns']:
+            data['isbns'][publisher_code] = ISBNList()
+        
+        data['isbns'][publisher_code].append(isbn)
+        
+        # Update the last used offset and book number for this prefix
+        data['prefix_offsets'][prefix] = offset
+        data['last_book_numbers'][prefix] = int(isbn[len(prefix):])
+    
+    def add_listener(self, callback):
+        """
+        Register a function to call whenever ISBNs are added to the storage.
+        
+        The callback receives the list of added ISBNs, or None when the storage was
+        reloaded from a snapshot written by another process and any ISBN may have been added.
+        ISBNs added by other processes are reported when a read or refresh() catches up with them.
+        """
+        self._add_listeners.append(callback)
+    
+    def refresh(self):
+        """Catch up with the ISBNs other processes have written, reporting them to the listeners."""
+        self._refresh_for_read()
+    
+    def remove_listener(self, callback):
+        """Stop calling a function registered with add_listener; does nothing if it is not registered."""
+        if callback in self._add_listeners:
+            self._add_listeners.remove(callback)
+    
+    def _notify_added(self, isbns):
+        """Pass newly added ISBNs to the registered listeners."""
+        for listener in self._add_listeners:
+            listener(isbns)
     
     def add_isbn(self, publisher_code, isbn, prefix, offset):
         """
@@ -49,17 +497,49 @@ class ISBNStorage:
         - prefix: The prefix used to generate the ISBN
         - offset: The offset used to generate the ISBN
         """
-        # Add ISBN to the publisher code's list
         publisher_code = str(publisher_code)
-        if publisher_code not in self.data['isbns']:
-            self.data['isbns'][publisher_code] = []
+        self._apply_isbn(self.data, publisher_code, isbn, prefix, offset)
+        self._index_isbn(isbn)
+        self._mark_slot(isbn)
         
-        self.data['isbns'][publisher_code].append(isbn)
+        if self.use_journal:
+            self._append_journal([{
+                'publisher_code': publisher_code,
+                'isbn': isbn,
+                'prefix': prefix,
+                'offset': offset
+            }])
+        else:
+            self._save_data()
+        self._notify_added([isbn])
+    
+    def add_isbns(self, records):
+        """
+        Add a batch of newly generated ISBNs to storage with a single write.
         
-        # Update the last used offset for this prefix
-        self.data['prefix_offsets'][prefix] = offset
+        Parameters:
+        - records: A list of (publisher_code, isbn, prefix, offset) tuples, as accepted by add_isbn
+        """
+        journal = []
+        for publisher_code, isbn, prefix, offset in records:
+            publisher_code = str(publisher_code)
+            self._apply_isbn(self.data, publisher_code, isbn, prefix, offset)
+            self._index_isbn(isbn)
+            self._mark_slot(isbn)
+            journal.append({
+                'publisher_code': publisher_code,
+                'isbn': isbn,
+                'prefix': prefix,
+                'offset': offset
+            })
         
-        self._save_data()
+        if not journal:
+            return
+        if self.use_journal:
+            self._append_journal(journal)
+        else:
+            self._save_data()
+        self._notify_added([record['isbn'] for record in journal])
     
     def get_next_offset(self, prefix):
         """
@@ -72,7 +552,7 @@ class ISBNStorage:
         - The next offset to try (one more than the last used offset, or 0 if no ISBN has been generated for this prefix)
         """
         current_offset = self.data['prefix_offsets'].get(prefix, -1)
-        return (current_offset + 1) % 15015  # Wrap around if we reach the maximum offset (3 * 5 * 7 * 11 * 13 = 15015)
+        return (current_offset + 1) % len(self.scheme.slots(prefix))  # Wrap around after the last valid book number slot
     
     def is_isbn_generated(self, isbn):
         """
@@ -84,10 +564,16 @@ class ISBNStorage:
         Returns:
         - True if the ISBN exists in storage, False otherwise
         """
-        for publisher_isbns in self.data['isbns'].values():
-            if isbn in publisher_isbns:
-                return True
-        return False
+        self._refresh_for_read()
+        isbn = str(isbn)
+        book_numbers = self._index.get(isbn[:self.scheme.prefix_length])
+        if not book_numbers or len(isbn) != 13 or not isbn.isdigit():
+            return False
+        
+        # Binary search the sorted book numbers of the prefix
+        book_number = int(isbn[self.scheme.prefix_length:])
+        position = bisect_left(book_numbers, book_number)
+        return position < len(book_numbers) and book_numbers[position] == book_number
     
     def list_isbns_for_publisher(self, publisher_code):
         """
@@ -99,11 +585,26 @@ class ISBNStorage:
         Returns:
         - List of ISBNs for the given publisher code
         """
+        self._refresh_for_read()
         publisher_code = str(publisher_code)
-        return self.data['isbns'].get(publisher_code, [])
+        return list(self.data['isbns'].get(publisher_code, ()))
+    
+    def count_isbns_for_prefix(self, prefix):
+        """
+        Count the ISBNs generated with a specific prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The number of stored ISBNs starting with the prefix
+        """
+        self._refresh_for_read()
+        return len(self._index.get(prefix, ()))
     
     def count_isbns(self):
         """Return the total number of generated ISBNs."""
+        self._refresh_for_read()
         count = 0
         for publisher_isbns in self.data['isbns'].values():
             count += len(publisher_isbns)
@@ -111,8 +612,15 @@ class ISBNStorage:
     
     @property
     def isbns(self):
-        """Getter for the isbns dictionary for backward compatibility."""
+        """Getter for the isbns dictionary for backward compatibility; its values are ISBNList views."""
         return self.data['isbns']
+    
+    def iter_isbns(self):
+        """Yield a (publisher_code, isbn) tuple for every stored ISBN, publisher by publisher."""
+        self._refresh_for_read()
+        for publisher_code, publisher_isbns in list(self.data['isbns'].items()):
+            for isbn in publisher_isbns:
+                yield publisher_code, isbn
 
     def get_last_book_number(self, prefix):
         """
@@ -124,33 +632,23 @@ class ISBNStorage:
         Returns:
         - The book number (last 7 digits) as an integer, or None if no ISBN has been generated for this prefix
         """
-        publisher_code = str(int(prefix[4:6]))
-        if publisher_code not in self.data['isbns'] or not self.data['isbns'][publisher_code]:
-            return None
-            
-        # Find ISBNs with this prefix
-        for isbn in self.data['isbns'][publisher_code]:
-            if isbn.startswith(prefix):
-                # Extract the book number (last 7 digits)
-                return int(isbn[6:])
-                
-        return None
-
-# Initialize the ISBN storage
-isbn_storage = ISBNStorage()
+        return self.data['last_book_numbers'].get(prefix)
 
 def extended_gcd(a, b):
     """
     Extended Euclidean Algorithm to find GCD and Bézout coefficients.
     Returns (gcd, x, y) such that a*x + b*y = gcd.
     """
-    if a == 0:
-        return b, 0, 1
-    else:
-        gcd, x1, y1 = extended_gcd(b % a, a)
-        x = y1 - (b // a) * x1
-        y = x1
-        return gcd, x, y
+    # Iterative form: keep the Bézout coefficients of the current and previous remainder
+    old_r, r = a, b
+    old_x, x = 1, 0
+    old_y, y = 0, 1
+    while r != 0:
+        quotient = old_r // r
+        old_r, r = r, old_r - quotient * r
+        old_x, x = x, old_x - quotient * x
+        old_y, y = y, old_y - quotient * y
+    return old_r, old_x, old_y
 
 def mod_inverse(a, m):
     """
@@ -177,140 +675,631 @@ def chinese_remainder_theorem(remainders, moduli):
     ...
     x ≡ rk (mod mk)
     """
-    # Compute the product of all moduli
-    M = 1
-    for m in moduli:
-        M *= m
+    return get_crt_basis(tuple(moduli)).solve(remainders)
+
+class CRTBasis:
+    """
+    Precomputed constants for solving CRT systems over a fixed set of moduli.
+    
+    For moduli m1, ..., mk with product M, the solution of x ≡ ri (mod mi) is
+    sum(ri * ci) mod M, where ci = (M / mi) * ((M / mi)^-1 mod mi). The ci only depend
+    on the moduli, so they are computed once and each solve is a few multiply-adds.
+    """
+    def __init__(self, moduli):
+        self.moduli = tuple(moduli)
+        
+        # Compute the product of all moduli
+        self.modulus = 1
+        for m in self.moduli:
+            self.modulus *= m
+        
+        # Compute the coefficient of each remainder
+        self.coefficients = tuple(
+            (self.modulus // m) * mod_inverse(self.modulus // m, m) % self.modulus
+            for m in self.moduli
+        )
+    
+    def solve(self, remainders):
+        """
+        Solve the system of congruences for the given remainders.
+        
+        Parameters:
+        - remainders: One remainder per modulus. These may also be NumPy arrays of
+                      remainders, which solves many systems at once.
+        
+        Returns the smallest non-negative solution (or an array of solutions).
+        """
+        result = 0
+        for remainder, coefficient in zip(remainders, self.coefficients):
+            result = result + remainder * coefficient
+        return result % self.modulus
+
+@lru_cache(maxsize=None)
+def get_crt_basis(moduli):
+    """
+    Get the (cached) CRTBasis for a tuple of moduli.
+    
+    Parameters:
+    - moduli: A tuple of pairwise coprime moduli
+    
+    Returns the CRTBasis for the moduli.
+    """
+    return CRTBasis(moduli)
+
+class ISBNScheme:
+    """
+    The layout and CRT conditions that ISBNs are generated and validated with.
+    
+    An ISBN consists of a prefix followed by a book number, and the publisher code is
+    read from a fixed range of prefix digits. The ISBN is valid when it leaves the same
+    remainder as its publisher code for every modulus of the scheme. Fewer or smaller
+    moduli give each prefix more valid book numbers (about 10^7 / product of the moduli
+    with the default layout).
+    
+    A scheme caches its CRTBasis and the PrefixSlots of every prefix it is used with,
+    so switching schemes never mixes up the precomputed values of another one.
+    """
+    def __init__(self, moduli=CRT_MODULI, prefix_length=6, publisher_code_start=4, publisher_code_end=6):
+        if not 0 < prefix_length < 13:
+            raise ValueError("The prefix length must be between 1 and 12 digits")
+        if not 0 <= publisher_code_start < publisher_code_end <= prefix_length:
+            raise ValueError("The publisher code must be a non-empty range of prefix digits")
+        
+        self.moduli = tuple(moduli)
+        self.basis = get_crt_basis(self.moduli)  # Raises ValueError if the moduli are not pairwise coprime
+        self.modulus = self.basis.modulus
+        self.prefix_length = prefix_length
+        self.publisher_code_start = publisher_code_start
+        self.publisher_code_end = publisher_code_end
+        self.book_number_digits = 13 - prefix_length
+        self.book_number_limit = 10 ** self.book_number_digits
+        
+        # The publisher code of an ISBN value is value // publisher_shift % publisher_limit
+        self.publisher_shift = 10 ** (13 - publisher_code_end)
+        self.publisher_limit = 10 ** (publisher_code_end - publisher_code_start)
+        
+        # Residue of each digit position modulo the modulus, so the 13 digits fold into one small residue
+        self.digit_residues = tuple(pow(10, 12 - i, self.modulus) for i in range(13))
+        
+        # Largest number of slots any prefix can have
+        self.max_slots = -(-self.book_number_limit // self.modulus)
+        self._slots = {}
+    
+    def __repr__(self):
+        return (f"ISBNScheme(moduli={self.moduli}, prefix_length={self.prefix_length}, "
+                f"publisher_code_start={self.publisher_code_start}, publisher_code_end={self.publisher_code_end})")
+    
+    def publisher_code(self, isbn):
+        """Return the publisher code of an ISBN or prefix string as an integer."""
+        return int(isbn[self.publisher_code_start:self.publisher_code_end])
+    
+    def slots(self, prefix):
+        """
+        Get the (cached) slot space of valid book numbers for a prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first prefix_length digits)
+        
+        Returns the PrefixSlots for the prefix.
+        """
+        slots = self._slots.get(prefix)
+        if slots is None:
+            with STAGE_SECONDS.time('crt_solve'):
+                slots = self._slots[prefix] = PrefixSlots(prefix, self)
+        return slots
+
+# The scheme used unless another one is given
+DEFAULT_SCHEME = ISBNScheme()
+
+class PrefixSlots:
+    """
+    The set of valid CRT book numbers for a single ISBN prefix.
+    
+    For a prefix with publisher code X, the full ISBN must be congruent to X modulo
+    every modulus of the scheme, i.e. modulo their product M (15015 by default). The
+    valid book numbers are therefore exactly base + slot * M for slot = 0, 1, ...,
+    len(slots) - 1, where base is the CRT solution computed once for the prefix. This
+    lets generation index the valid book numbers directly instead of searching for them.
+    """
+    def __init__(self, prefix, scheme=None):
+        scheme = scheme or DEFAULT_SCHEME
+        self.prefix = prefix
+        self.scheme = scheme
+        self.modulus = scheme.modulus
+        self.book_number_digits = scheme.book_number_digits
+        self.publisher_code = scheme.publisher_code(prefix)
+        
+        # Target remainders and moduli
+        moduli = scheme.moduli
+        target_remainders = [self.publisher_code % m for m in moduli]
+        
+        # Find B such that (prefix_int * 10^7 + B) mod m_i = r_i for all i
+        prefix_shift = int(prefix) * scheme.book_number_limit
+        prefix_remainders = [prefix_shift % m for m in moduli]
+        needed_remainders = [(target_remainders[i] - prefix_remainders[i]) % moduli[i] for i in range(len(moduli))]
+        
+        self.base = scheme.basis.solve(needed_remainders)
+        self.slot_count = (scheme.book_number_limit - 1 - self.base) // self.modulus + 1
+    
+    def __len__(self):
+        return self.slot_count
+    
+    def book_number(self, slot):
+        """Return the book number (last 7 digits) stored in a slot."""
+        return self.base + slot * self.modulus
+    
+    def isbn(self, slot):
+        """Return the full 13-digit ISBN for a slot."""
+        return f"{self.prefix}{self.base + slot * self.modulus:0{self.book_number_digits}d}"
+    
+    def slot_of(self, book_number):
+        """
+        Find the slot of a book number.
+        
+        Parameters:
+        - book_number: The book number (last 7 digits) as an integer
+        
+        Returns:
+        - The slot index, or None if the book number does not satisfy the CRT conditions for this prefix
+        """
+        slot, remainder = divmod(book_number - self.base, self.modulus)
+        if remainder or slot < 0 or slot >= self.slot_count:
+            return None
+        return slot
+
+def get_prefix_slots(prefix, scheme=None):
+    """
+    Get the (cached) slot space of valid book numbers for a prefix.
+    
+    Parameters:
+    - prefix: The 6-digit ISBN prefix
+    - scheme: The ISBNScheme to use (default: DEFAULT_SCHEME)
+    
+    Returns the PrefixSlots for the prefix.
+    """
+    return (scheme or DEFAULT_SCHEME).slots(prefix)
+
+class SlotAllocator:
+    """
+    Bitmap of the used book number slots of a single prefix.
+    
+    Bit i of the bitmap is set once slot i (see PrefixSlots) has been handed out.
+    The bitmap is kept in a Python integer, so finding the next free slot is a
+    couple of word-level bit operations rather than a search through storage.
+    """
+    def __init__(self, capacity, bitmap=0):
+        self.capacity = capacity
+        self.bitmap = bitmap
+        self.used_count = bin(bitmap).count('1')
+        self._full_mask = (1 << capacity) - 1
+    
+    @classmethod
+    def from_hex(cls, capacity, bitmap_hex):
+        """Create an allocator from a bitmap serialized with to_hex."""
+        return cls(capacity, int(bitmap_hex, 16))
+    
+    def to_hex(self):
+        """Serialize the bitmap as a hexadecimal string."""
+        return f"{self.bitmap:x}"
+    
+    @property
+    def free_count(self):
+        """The number of slots that have not been used yet."""
+        return self.capacity - self.used_count
+    
+    def is_used(self, slot):
+        """Return True if the slot has already been used."""
+        return bool(self.bitmap >> slot & 1)
+    
+    def mark_used(self, slot):
+        """Mark a slot as used."""
+        if not self.bitmap >> slot & 1:
+            self.bitmap |= 1 << slot
+            self.used_count += 1
+    
+    def next_free(self, start=0, wrap=True):
+        """
+        Find the first free slot at or after 'start', wrapping around to slot 0.
+        
+        Parameters:
+        - start: The slot to start searching from
+        - wrap: Whether to continue from slot 0 when no slot at or after 'start' is free
+        
+        Returns the free slot index, or None if no slot is free.
+        """
+        free = ~self.bitmap & self._full_mask
+        if not free:
+            return None
+        
+        # Prefer free slots at or after the start, otherwise wrap around
+        after_start = free >> start << start
+        if after_start:
+            free = after_start
+        elif not wrap:
+            return None
+        return (free & -free).bit_length() - 1
+    
+    def prev_free(self, end):
+        """
+        Find the last free slot at or before 'end', without wrapping around.
+        
+        Parameters:
+        - end: The slot to start searching backwards from
+        
+        Returns the free slot index, or None if no slot up to 'end' is free.
+        """
+        if end < 0:
+            return None
+        free = ~self.bitmap & self._full_mask & ((2 << end) - 1)
+        return free.bit_length() - 1 if free else None
+    
+    def allocate(self, count=1, start=0, contiguous=False):
+        """
+        Reserve several free slots at once.
+        
+        Parameters:
+        - count: The number of slots to reserve
+        - start: The slot to start searching from (wrapping around to slot 0)
+        - contiguous: Whether the slots must form a single run of consecutive slots
+        
+        Returns the list of reserved slots. Without 'contiguous' this holds up to 'count'
+        slots in search order; with 'contiguous' it is empty unless a long enough run exists.
+        """
+        if count < 1:
+            return []
+        
+        if contiguous:
+            # Bit i of 'runs' is set when slots i .. i + count - 1 are all free
+            runs = ~self.bitmap & self._full_mask
+            for i in range(1, count):
+                runs &= runs >> 1
+            if not runs:
+                return []
+            after_start = runs >> start << start
+            if after_start:
+                runs = after_start
+            first = (runs & -runs).bit_length() - 1
+            slots = list(range(first, first + count))
+        else:
+            slots = []
+            slot = start
+            while len(slots) < count:
+                slot = self.next_free(slot)
+                if slot is None:
+                    break
+                slots.append(slot)
+                self.mark_used(slot)
+        
+        for slot in slots:
+            self.mark_used(slot)
+        return slots
+
+def open_storage(storage_file=ISBN_STORAGE_FILE, scheme=None):
+    """
+    Open ISBN storage with the backend matching the storage file extension.
+    
+    Parameters:
+    - storage_file: The storage file; files ending in MMAP_STORAGE_SUFFIX use the
+                    memory-mapped backend, files ending in one of SQLITE_STORAGE_SUFFIXES
+                    the SQLite backend, anything else the JSON backend
+    - scheme: The ISBNScheme of the stored ISBNs (default: DEFAULT_SCHEME)
+    
+    Returns the storage object.
+    """
+    if storage_file.endswith(MMAP_STORAGE_SUFFIX):
+        from isbn_mmap_storage import MmapISBNStorage
+        return MmapISBNStorage(storage_file, scheme)
+    if storage_file.endswith(SQLITE_STORAGE_SUFFIXES):
+        from isbn_sqlite_storage import SQLiteISBNStorage
+        return SQLiteISBNStorage(storage_file, scheme)
+    return ISBNStorage(storage_file, scheme=scheme)
+
+# Guards the creation of the default storage
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """
+    Get the default ISBN storage, opening ISBN_STORAGE_FILE on first use.
     
-    # Compute the solution
-    result = 0
-    for i in range(len(remainders)):
-        Mi = M // moduli[i]  # M divided by mi
-        inv = mod_inverse(Mi, moduli[i])  # Modular inverse of Mi modulo mi
-        result += remainders[i] * Mi * inv
+    Importing this module does not touch the storage file, so code that only validates
+    ISBNs never loads it. The storage is also available as the module attribute
+    isbn_storage, which can be replaced (or set with set_storage) to use another store.
     
-    return result % M
+    Returns the storage object.
+    """
+    storage = globals().get('isbn_storage')
+    if storage is None:
+        with _storage_lock:
+            storage = globals().get('isbn_storage')
+            if storage is None:
+                storage = globals()['isbn_storage'] = open_storage()
+    return storage
+
+def set_storage(storage):
+    """Replace the default ISBN storage, e.g. with a store opened by open_storage."""
+    globals()['isbn_storage'] = storage
+
+def __getattr__(name):
+    # Create isbn_storage lazily when it is first accessed as a module attribute
+    if name == 'isbn_storage':
+        return get_storage()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def generate_isbn(prefix="978316", offset=None, max_attempts=15015, verbose=True, use_multiples=True):
+def find_multiple_slot(slots, allocator, last_book_number, max_attempts=None):
+    """
+    Find the smallest multiple of a previous book number that lands on a free slot.
+    
+    Parameters:
+    - slots: The PrefixSlots of the prefix
+    - allocator: The SlotAllocator tracking the used slots of the prefix
+    - last_book_number: The book number to take multiples of
+    - max_attempts: Maximum number of multiples to try (default: the scheme's modulus M)
+    
+    Returns a (slot, multiplier) tuple, or (None, None) if no multiple is usable.
+    """
+    if max_attempts is None:
+        max_attempts = slots.scheme.modulus
+    with STAGE_SECONDS.time('multiples_search'):
+        collisions = 0
+        for multiplier in range(2, max_attempts + 2):  # Start from 2 since 1 would be the same book number
+            # Calculate the new book number
+            new_book_number = (last_book_number * multiplier) % slots.scheme.book_number_limit  # Keep within 7 digits
+            
+            # A multiple only satisfies the CRT conditions if it lands on a slot
+            slot = slots.slot_of(new_book_number)
+            if slot is not None:
+                if not allocator.is_used(slot):
+                    _record_multiples(slots.prefix, multiplier - 1, collisions)
+                    return slot, multiplier
+                collisions += 1
+        _record_multiples(slots.prefix, max_attempts, collisions)
+        return None, None
+
+def _record_multiples(prefix, attempts, collisions):
+    """Record the multiples tried by find_multiple_slot and how many landed on used slots."""
+    if metrics.enabled:
+        MULTIPLE_ATTEMPTS.inc(prefix, amount=attempts)
+        if collisions:
+            SLOT_COLLISIONS.inc(prefix, amount=collisions)
+
+def generate_isbn(prefix="978316", offset=None, max_attempts=None, verbose=True, use_multiples=True, storage=None):
     """
     Generate a 13-digit ISBN using the Chinese Remainder Theorem.
     
     Parameters:
     - prefix: The 6-digit prefix (default: "978316")
-    - offset: An offset to generate different ISBNs for the same publisher code
-              If None, the next available offset from storage will be used
-    - max_attempts: Maximum number of attempts to generate a unique ISBN (default: 15015, which is 3 * 5 * 7 * 11 * 13)
+    - offset: The book number slot to use (see PrefixSlots)
+              If None, the next free slot after the last used offset in storage will be used
+    - max_attempts: Maximum number of multiples to try (default: the modulus of the storage's
+                    scheme, 15015 = 3 * 5 * 7 * 11 * 13 for the default scheme)
     - verbose: Whether to print detailed output
     - use_multiples: Whether to use multiples of the last book number (if available)
+    - storage: The storage to generate into (default: get_storage())
     
     Returns the generated 13-digit ISBN as a string, or None if no unique ISBN can be generated.
     """
-    # Extract the publisher code from the prefix
-    X = int(prefix[4:6])
+    if storage is None:
+        storage = get_storage()
+    
+    # Pick and store the ISBN in one critical section, so concurrent callers never get the same slot
+    with STAGE_SECONDS.time('generate'), storage.transaction():
+        return _generate_isbn(prefix, offset, max_attempts, verbose, use_multiples, storage)
+
+def _generate_isbn(prefix, offset, max_attempts, verbose, use_multiples, storage):
+    """Generate a single ISBN (see generate_isbn); the caller holds the storage transaction."""
+    slots = storage.scheme.slots(prefix)
+    X = slots.publisher_code
+    
+    allocator = storage.get_slot_allocator(prefix)
+    if allocator.free_count == 0:
+        PREFIXES_EXHAUSTED.inc(prefix)
+        if verbose:
+            print(f"All {len(slots)} ISBNs for prefix {prefix} have been generated.")
+        return None
     
     # Check if we should use multiples of previous book numbers
     last_book_number = None
     if use_multiples:
-        last_book_number = isbn_storage.get_last_book_number(prefix)
+        last_book_number = storage.get_last_book_number(prefix)
         
     if last_book_number is not None:
         # We have a previous book number, generate a multiple
         if verbose:
             print(f"Using multiple method with previous book number...")
         
-        # Start with the last book number and try multiples
-        modulus = 3 * 5 * 7 * 11 * 13  # = 15015
-        
-        # Compute remainders of X (publisher code)
-        r3 = X % 3
-        r5 = X % 5
-        r7 = X % 7
-        r11 = X % 11
-        r13 = X % 13
-        
-        # Try different multiples
-        for multiplier in range(2, max_attempts + 2):  # Start from 2 since 1 would be the same book number
-            # Calculate the new book number
-            new_book_number = (last_book_number * multiplier) % 10000000  # Keep within 7 digits
-            
-            # Form the complete ISBN
-            isbn = f"{prefix}{new_book_number:07d}"
-            
-            # Check if this ISBN already exists
-            if isbn_storage.is_isbn_generated(isbn):
-                continue
-            
-            # Check if this ISBN satisfies the CRT conditions
-            full_num = int(isbn)
-            isbn_r3 = full_num % 3
-            isbn_r5 = full_num % 5
-            isbn_r7 = full_num % 7
-            isbn_r11 = full_num % 11
-            isbn_r13 = full_num % 13
+        slot, multiplier = find_multiple_slot(slots, allocator, last_book_number, max_attempts)
+        if slot is not None:
+            if verbose:
+                print(f"Created a new ISBN using multiple: {multiplier}")
             
-            if isbn_r3 == r3 and isbn_r5 == r5 and isbn_r7 == r7 and isbn_r11 == r11 and isbn_r13 == r13:
-                if verbose:
-                    print(f"Created a new ISBN using multiple: {multiplier}")
-                
-                # Store the ISBN
-                isbn_storage.add_isbn(X, isbn, prefix, (offset or 0))
-                return isbn
+            # Store the ISBN
+            isbn = slots.isbn(slot)
+            storage.add_isbn(X, isbn, prefix, slot)
+            ISBNS_ISSUED.inc(prefix)
+            return isbn
         
+        OFFSET_FALLBACKS.inc(prefix)
         if verbose:
             print("Could not find a valid multiple, using alternative method...")
     
     # If no previous book number or couldn't find valid multiple, fall back to offset method
-    # If no offset is provided, get the next one from storage
     if offset is None:
-        offset = isbn_storage.get_next_offset(prefix)
+        # Take the next free slot after the last one used for this prefix
+        slot = allocator.next_free(storage.get_next_offset(prefix))
+    else:
+        slot = offset % len(slots)
+        if allocator.is_used(slot):
+            SLOT_COLLISIONS.inc(prefix)
+            slot = None
     
-    # Compute remainders of X
-    r3 = X % 3
-    r5 = X % 5
-    r7 = X % 7
-    r11 = X % 11
-    r13 = X % 13
+    if slot is not None:
+        # Store the ISBN and the offset used
+        isbn = slots.isbn(slot)
+        storage.add_isbn(X, isbn, prefix, slot)
+        ISBNS_ISSUED.inc(prefix)
+        return isbn
     
-    # Target remainders and moduli
-    target_remainders = [r3, r5, r7, r11, r13]
-    moduli = [3, 5, 7, 11, 13]
+    if verbose:
+        print(f"Failed to generate a unique ISBN.")
+    return None
+
+def generate_isbns(prefix="978316", count=10, max_attempts=None, verbose=False, use_multiples=True, storage=None):
+    """
+    Generate a batch of 13-digit ISBNs with the same prefix.
     
-    # Find B such that (prefix_int * 10^7 + B) mod m_i = r_i for all i
-    prefix_int = int(prefix)
-    prefix_shift = prefix_int * 10**7  # This is the value of the prefix shifted 7 places
+    This is equivalent to calling generate_isbn 'count' times, but the CRT solution for
+    the prefix is computed once, all slots are reserved in one pass and the batch is
+    written to storage with a single commit.
     
-    # For each modulus, find the remainder of prefix_shift
-    prefix_remainders = [prefix_shift % m for m in moduli]
+    Parameters:
+    - prefix: The 6-digit prefix (default: "978316")
+    - count: The number of ISBNs to generate (at most MAX_BATCH_SIZE)
+    - max_attempts: Maximum number of multiples to try per ISBN (default: the scheme's modulus)
+    - verbose: Whether to print detailed output
+    - use_multiples: Whether to use multiples of the last book number (if available)
+    - storage: The storage to generate into (default: get_storage())
     
-    # Calculate the needed remainders for B
-    needed_remainders = [(target_remainders[i] - prefix_remainders[i]) % moduli[i] for i in range(len(moduli))]
+    Returns the list of generated ISBNs, which is shorter than 'count' if the prefix runs out of unique ISBNs.
+    """
+    if count < 1 or count > MAX_BATCH_SIZE:
+        raise ValueError(f"Count must be between 1 and {MAX_BATCH_SIZE}")
+    if storage is None:
+        storage = get_storage()
     
-    # Use CRT to find B
-    B = chinese_remainder_theorem(needed_remainders, moduli)
+    # Reserve and store the batch in one critical section, so concurrent callers never get the same slots
+    with STAGE_SECONDS.time('generate_batch'), storage.transaction():
+        return _generate_isbns(prefix, count, max_attempts, verbose, use_multiples, storage)
+
+def _generate_isbns(prefix, count, max_attempts, verbose, use_multiples, storage):
+    """Generate a batch of ISBNs (see generate_isbns); the caller holds the storage transaction."""
+    slots = storage.scheme.slots(prefix)
+    X = slots.publisher_code
+    allocator = storage.get_slot_allocator(prefix)
     
-    # Apply offset (adjusting B by offset * modulus)
-    B = (B + offset * 3 * 5 * 7 * 11 * 13) % 10000000  # Keep B within 7 digits
+    # Never try to reserve more ISBNs than the prefix has left
+    count = min(count, allocator.free_count)
+    if count == 0:
+        PREFIXES_EXHAUSTED.inc(prefix)
+    reserved = []
     
-    # Form the complete ISBN
-    isbn = f"{prefix}{B:07d}"
+    # Reserve multiples of the previous book number first, like generate_isbn does
+    last_book_number = storage.get_last_book_number(prefix) if use_multiples else None
+    while last_book_number is not None and len(reserved) < count:
+        slot, multiplier = find_multiple_slot(slots, allocator, last_book_number, max_attempts)
+        if slot is None:
+            OFFSET_FALLBACKS.inc(prefix)
+            if verbose:
+                print("Could not find a valid multiple, using alternative method...")
+            break
+        allocator.mark_used(slot)
+        reserved.append(slot)
+        
+        # Continue from the new book number, as the next generate_isbn call would
+        last_book_number = slots.book_number(slot)
     
-    # Check if this ISBN has already been generated
-    if not isbn_storage.is_isbn_generated(isbn):
-        # Store the ISBN and the offset used
-        isbn_storage.add_isbn(X, isbn, prefix, offset)
-        return isbn
+    # Reserve the remaining ISBNs from the next free slots
+    if len(reserved) < count:
+        reserved.extend(allocator.allocate(count - len(reserved), start=storage.get_next_offset(prefix)))
+    
+    # Persist the whole batch at once
+    isbns = [slots.isbn(slot) for slot in reserved]
+    storage.add_isbns([(X, isbn, prefix, slot) for isbn, slot in zip(isbns, reserved)])
+    ISBNS_ISSUED.inc(prefix, amount=len(isbns))
     
     if verbose:
-        print(f"Failed to generate a unique ISBN.")
-    return None
+        print(f"Generated {len(isbns)} ISBNs with prefix {prefix}.")
+        if len(isbns) < count:
+            print("No more unique ISBNs can be generated for this prefix.")
+    return isbns
+
+def iter_generate_isbns(prefix="978316", count=10, chunk_size=1000, max_attempts=None, use_multiples=True, storage=None):
+    """
+    Generate ISBNs lazily, storing them one chunk at a time.
+    
+    Each chunk is generated and committed by generate_isbns before its ISBNs are
+    yielded, so the count is not limited to MAX_BATCH_SIZE, memory use does not grow
+    with the count and the storage lock is released between chunks. Closing the
+    generator early stops after the current chunk.
+    
+    Parameters:
+    - prefix: The 6-digit prefix (default: "978316")
+    - count: The number of ISBNs to generate
+    - chunk_size: The number of ISBNs generated and stored at once (at most MAX_BATCH_SIZE)
+    - max_attempts: Maximum number of multiples to try per ISBN (default: the scheme's modulus)
+    - use_multiples: Whether to use multiples of the last book number (if available)
+    - storage: The storage to generate into (default: get_storage())
+    
+    Yields the generated ISBNs, stopping early if the prefix runs out of unique ISBNs.
+    """
+    remaining = count
+    while remaining > 0:
+        chunk = generate_isbns(
+            prefix, min(remaining, chunk_size, MAX_BATCH_SIZE), max_attempts, use_multiples=use_multiples, storage=storage
+        )
+        if not chunk:
+            return
+        remaining -= len(chunk)
+        yield from chunk
 
-def check_isbn(isbn, verbose=True):
+def suggest_isbns(isbn, count=3, storage=None):
+    """
+    Find the valid, unused ISBNs nearest to an ISBN.
+    
+    The valid book numbers of a prefix are the evenly spaced slots of its PrefixSlots,
+    so the slots around the input's book number follow by division, and the nearest
+    free ones are found with bit operations on the prefix's slot bitmap rather than by
+    scanning storage. The ISBNs are only suggestions; they are not reserved and may be
+    generated by someone else before they are used.
+    
+    Parameters:
+    - isbn: A string or integer representing a 13-digit ISBN; its prefix is kept
+    - count: The number of suggestions to return
+    - storage: The storage whose used slots are skipped (default: get_storage())
+    
+    Returns a list of up to 'count' ISBNs, the nearest book number first (the lower one on a tie).
+    The list is empty if the input is not 13 digits or the prefix cannot hold any more ISBNs.
+    """
+    isbn_str = str(isbn)
+    if count < 1 or len(isbn_str) != 13 or not (isbn_str.isascii() and isbn_str.isdigit()):
+        return []
+    if storage is None:
+        storage = get_storage()
+    
+    scheme = storage.scheme
+    prefix = isbn_str[:scheme.prefix_length]
+    book_number = int(isbn_str[scheme.prefix_length:])
+    slots = scheme.slots(prefix)
+    try:
+        # Prefixes without ISBNs get an empty allocator, so lookups of random input do not create entries in storage
+        allocator = storage.get_slot_allocator(prefix) if storage.count_isbns_for_prefix(prefix) else SlotAllocator(len(slots))
+    except ValueError:  # The storage cannot hold ISBNs with this prefix
+        return []
+    
+    # The slot at or just below the book number, and the free slots on either side of it
+    floor_slot = min((book_number - slots.base) // slots.modulus, len(slots) - 1)
+    below = allocator.prev_free(floor_slot)
+    above = allocator.next_free(max(floor_slot + 1, 0), wrap=False)
+    
+    suggestions = []
+    while len(suggestions) < count and (below is not None or above is not None):
+        if above is None or (below is not None and book_number - slots.book_number(below) <= slots.book_number(above) - book_number):
+            suggestions.append(slots.isbn(below))
+            below = allocator.prev_free(below - 1)
+        else:
+            suggestions.append(slots.isbn(above))
+            above = allocator.next_free(above + 1, wrap=False)
+    return suggestions
+
+def check_isbn(isbn, verbose=True, scheme=None, storage=None, suggestions=0):
     """
     Check if an ISBN was generated using the CRT method.
     
     Parameters:
     - isbn: A string or integer representing a 13-digit ISBN
     - verbose: Whether to print detailed output
+    - scheme: The ISBNScheme to check against (default: DEFAULT_SCHEME)
+    - storage: The storage to look valid ISBNs up in (default: get_storage())
+    - suggestions: The number of nearest valid, unused ISBNs to add as "suggested_isbns" (see suggest_isbns)
     
     Returns:
     - True if the ISBN is valid, False otherwise
@@ -326,6 +1315,8 @@ def check_isbn(isbn, verbose=True):
         "error_message": ""
     }
     
+    scheme = scheme or DEFAULT_SCHEME
+    
     try:
         # Convert to string if an integer is provided
         isbn_str = str(isbn)
@@ -333,67 +1324,66 @@ def check_isbn(isbn, verbose=True):
         # Ensure it's a 13-digit ISBN
         if len(isbn_str) != 13:
             result_info["error_message"] = "ISBN must be 13 digits."
+            VALIDATIONS.inc('malformed')
             if verbose:
                 print("Error: ISBN must be 13 digits.")
             return False, result_info
         
-        # Extract the publisher code Z from positions 5 and 6 (0-indexed: 4 and 5)
-        Z = int(isbn_str[4:6])
+        # Extract the publisher code Z (by default from positions 5 and 6, 0-indexed: 4 and 5)
+        Z = scheme.publisher_code(isbn_str)
         result_info["publisher_code"] = Z
         
         if verbose:
             print(f"Publisher code: {Z}")
         
         # Compute remainders of Z (publisher code)
-        z_r3 = Z % 3
-        z_r5 = Z % 5
-        z_r7 = Z % 7
-        z_r11 = Z % 11
-        z_r13 = Z % 13
-        result_info["expected_remainders"] = [z_r3, z_r5, z_r7, z_r11, z_r13]
+        expected_remainders = [Z % m for m in scheme.moduli]
+        result_info["expected_remainders"] = expected_remainders
         
         # Convert the full ISBN to an integer
         Y = int(isbn_str)
         
         # Compute the remainders of the full ISBN
-        y_r3 = Y % 3
-        y_r5 = Y % 5
-        y_r7 = Y % 7
-        y_r11 = Y % 11
-        y_r13 = Y % 13
-        result_info["actual_remainders"] = [y_r3, y_r5, y_r7, y_r11, y_r13]
+        actual_remainders = [Y % m for m in scheme.moduli]
+        result_info["actual_remainders"] = actual_remainders
         
         # Check if the remainders match
-        if (y_r3 == z_r3 and y_r5 == z_r5 and y_r7 == z_r7 
-            and y_r11 == z_r11 and y_r13 == z_r13):
+        if actual_remainders == expected_remainders:
             result_info["valid"] = True
             
             if verbose:
                 print(f"ISBN {isbn_str} is valid according to the CRT method.")
             
             # Check if this ISBN is in our storage
-            if isbn_storage.is_isbn_generated(isbn_str):
+            with STAGE_SECONDS.time('storage_lookup'):
+                in_storage = (storage or get_storage()).is_isbn_generated(isbn_str)
+            VALIDATIONS.inc('valid')
+            if in_storage:
                 result_info["in_storage"] = True
                 if verbose:
                     print("This ISBN has been previously generated and is in storage.")
             elif verbose:
                 print("This ISBN is valid but is not in storage (not previously generated).")
+            
+            if suggestions:
+                result_info["suggested_isbns"] = suggest_isbns(isbn_str, suggestions, storage)
                 
             return True, result_info
         else:
+            VALIDATIONS.inc('invalid')
             if verbose:
                 print(f"Error: ISBN {isbn_str} is not valid according to the CRT method.")
             
             # Let's generate the correct ISBN for this publisher code
-            prefix = isbn_str[:6]  # Keep the original prefix including publisher code
+            prefix = isbn_str[:scheme.prefix_length]  # Keep the original prefix including publisher code
             prefix_int = int(prefix)
             
-            # Target remainders from the publisher code
-            target_remainders = [z_r3, z_r5, z_r7]
-            moduli = [3, 5, 7]
+            # Target remainders from the publisher code, for the first three moduli
+            target_remainders = expected_remainders[:3]
+            moduli = list(scheme.moduli[:3])
             
             # For each modulus, find the remainder of prefix_shift
-            prefix_shift = prefix_int * 10**7
+            prefix_shift = prefix_int * scheme.book_number_limit
             prefix_remainders = [prefix_shift % m for m in moduli]
             
             # Calculate the needed remainders for B
@@ -403,29 +1393,281 @@ def check_isbn(isbn, verbose=True):
             B = chinese_remainder_theorem(needed_remainders, moduli)
             
             # Make sure B is in the range [0, 10^7 - 1]
-            while B >= 10**7:
-                B -= 3 * 5 * 7 * 11 * 13  # = 15015
+            while B >= scheme.book_number_limit:
+                B -= scheme.modulus
             
             # If B is negative, add modulus until it's positive
             while B < 0:
-                B += 3 * 5 * 7 * 11 * 13  # = 15015
+                B += scheme.modulus
             
             # Form the correct ISBN
-            correct_isbn = f"{prefix}{B:07d}"
+            correct_isbn = f"{prefix}{B:0{scheme.book_number_digits}d}"
             result_info["corrected_isbn"] = correct_isbn
             
             if verbose:
                 print(f"A valid ISBN with this prefix would be: {correct_isbn}")
             
+            if suggestions:
+                # Unlike the correction, these satisfy every modulus and are not in storage
+                result_info["suggested_isbns"] = suggest_isbns(isbn_str, suggestions, storage)
+                if verbose and result_info["suggested_isbns"]:
+                    print(f"Nearest unused valid ISBNs: {', '.join(result_info['suggested_isbns'])}")
+            
             return False, result_info
     
     except ValueError as e:
         result_info["error_message"] = f"Invalid ISBN format - {e}"
+        VALIDATIONS.inc('malformed')
         if verbose:
             print(f"Error: Invalid ISBN format - {e}")
         return False, result_info
 
-def generate_isbn_with_publisher_code(publisher_code, offset=None, max_attempts=15015, verbose=True):
+# Result of fast_check_isbn for input that is not a 13-digit ISBN
+_MALFORMED = (False, None, None)
+
+def fast_check_isbn(isbn, scheme=None):
+    """
+    Check an ISBN against the CRT conditions without building a result dictionary.
+    
+    Because the moduli are pairwise coprime, the ISBN leaves the same remainders as its
+    publisher code for every modulus exactly when both are congruent modulo the product
+    of the moduli, so a single remainder decides validity. Storage is not consulted; use
+    check_isbn for the full diagnostics.
+    
+    Parameters:
+    - isbn: 13 ASCII digits as bytes, bytearray, memoryview or str, or an integer
+    - scheme: The ISBNScheme to check against (default: DEFAULT_SCHEME)
+    
+    Returns a tuple (valid, publisher_code, residue), where residue is the ISBN modulo
+    scheme.modulus (its remainder for a modulus m is residue % m). For malformed input
+    the tuple is (False, None, None).
+    """
+    scheme = scheme or DEFAULT_SCHEME
+    if isinstance(isbn, int):
+        # Like check_isbn, an integer must have exactly 13 digits
+        if not 10**12 <= isbn < 10**13:
+            return _MALFORMED
+        value = isbn
+        publisher_code = value // scheme.publisher_shift % scheme.publisher_limit
+    else:
+        if isinstance(isbn, memoryview):
+            isbn = isbn.tobytes()
+        if len(isbn) != 13 or not (isbn.isascii() and isbn.isdigit()):
+            return _MALFORMED
+        # int() parses the 13 digits in C, which beats folding them through scheme.digit_residues in Python
+        value = int(isbn)
+        publisher_code = int(isbn[scheme.publisher_code_start:scheme.publisher_code_end])
+    
+    residue = value % scheme.modulus
+    return residue == publisher_code % scheme.modulus, publisher_code, residue
+
+class ValidationCache:
+    """
+    Bounded least-recently-used cache of check_isbn results, by ISBN string and scheme.
+    
+    Only the storage membership part of a result can change over time, and only from
+    "not in storage" to "in storage". The cache therefore registers itself as a
+    listener of the storage it is bound to and drops the entries of ISBNs as they are
+    added. Every invalidation also bumps a generation number, and put() refuses results
+    computed before the latest invalidation, so a check racing with an addition cannot
+    cache a stale "not in storage".
+    """
+    def __init__(self, maxsize=VALIDATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._storage = None
+        self.generation = 0
+    
+    def bind(self, storage):
+        """Start tracking the ISBNs added to a storage, dropping results computed against another one."""
+        if storage is self._storage:
+            return
+        with self._lock:
+            if storage is not self._storage:
+                if self._storage is not None:
+                    self._storage.remove_listener(self.invalidate)
+                self._entries.clear()
+                self.generation += 1
+                storage.add_listener(self.invalidate)
+                self._storage = storage
+    
+    def get(self, isbn, scheme):
+        """Return the cached result for an ISBN string and scheme, or None, counting the hit or miss."""
+        with self._lock:
+            value = self._entries.get(isbn, {}).get(scheme)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(isbn)
+            self.hits += 1
+            return value
+    
+    def put(self, isbn, scheme, value, generation=None):
+        """
+        Cache a result, evicting the least recently used ISBN when the cache is full.
+        
+        Parameters:
+        - isbn: The ISBN string
+        - scheme: The ISBNScheme the result was computed for
+        - value: The (is_valid, result_info) tuple
+        - generation: The generation read before computing the result; the result is
+                      dropped if the cache was invalidated since (default: always store)
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries.setdefault(isbn, {})[scheme] = value
+            self._entries.move_to_end(isbn)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, isbns):
+        """
+        Drop the cached results of ISBNs.
+        
+        Parameters:
+        - isbns: The ISBNs whose results changed, or None to drop every entry
+        """
+        with self._lock:
+            self.generation += 1
+            if isbns is None:
+                self._entries.clear()
+                return
+            for isbn in isbns:
+                self._entries.pop(isbn, None)
+    
+    def clear(self):
+        """Drop every entry and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        """Return the hit and miss counts and the current and maximum size."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+# Cache used by cached_check_isbn
+validation_cache = ValidationCache()
+
+def cached_check_isbn(isbn, scheme=None, storage=None):
+    """
+    Check an ISBN like check_isbn (without output), reusing recent results.
+    
+    Parameters:
+    - isbn: A string or integer representing a 13-digit ISBN
+    - scheme: The ISBNScheme to check against (default: DEFAULT_SCHEME)
+    - storage: The storage to look valid ISBNs up in (default: get_storage())
+    
+    Returns the same (is_valid, result_info) tuple as check_isbn. The dictionary and
+    the lists in it are copies, so callers may change them.
+    """
+    scheme = scheme or DEFAULT_SCHEME
+    if storage is None:
+        storage = get_storage()
+    validation_cache.bind(storage)
+    # Let ISBNs stored by other processes invalidate their cached results
+    storage.refresh()
+    isbn = str(isbn)
+    
+    cached = validation_cache.get(isbn, scheme)
+    if cached is None:
+        # Read the generation first so an addition during the check discards the result
+        generation = validation_cache.generation
+        cached = check_isbn(isbn, verbose=False, scheme=scheme, storage=storage)
+        validation_cache.put(isbn, scheme, cached, generation)
+    is_valid, result_info = cached
+    return is_valid, {key: list(value) if isinstance(value, list) else value for key, value in result_info.items()}
+
+def check_isbns_array(isbns, record_size=None, use_numpy=None, scheme=None):
+    """
+    Check many ISBNs against the CRT conditions in one vectorized pass.
+    
+    Parameters:
+    - isbns: Either a sequence or array of ISBNs as integers (e.g. a uint64 array), or a
+             bytes-like buffer of fixed-width records, each holding 13 ASCII digits
+             optionally followed by separator bytes (e.g. a newline)
+    - record_size: Size in bytes of one buffer record (default: 13 plus the length of
+                   the line separator after the first record, e.g. 14 for "\n" and
+                   15 for "\r\n")
+    - use_numpy: Whether to use NumPy (default: when it is installed)
+    - scheme: The ISBNScheme to check against (default: DEFAULT_SCHEME)
+    
+    Returns a tuple (valid, expected_remainders, actual_remainders):
+    - valid: One boolean per ISBN
+    - expected_remainders: Remainders of each publisher code modulo the scheme's moduli
+    - actual_remainders: Remainders of each full ISBN modulo the scheme's moduli
+    With NumPy these are a bool array of shape (n,) and uint64 arrays of shape (n, k)
+    for k moduli, otherwise lists of booleans and lists of remainder lists.
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    scheme = scheme or DEFAULT_SCHEME
+    
+    is_buffer = isinstance(isbns, (bytes, bytearray, memoryview))
+    if is_buffer:
+        buffer = bytes(isbns)
+        if record_size is None:
+            # The separator of the first record sets the width of every record
+            separator = buffer[13:15]
+            record_size = 13 + len(separator) - len(separator.lstrip(b'\r\n'))
+        # Allow the last record to omit its separator
+        if len(buffer) % record_size:
+            buffer += b'\n' * (record_size - len(buffer) % record_size)
+    
+    if use_numpy:
+        moduli = np.array(scheme.moduli, dtype=np.uint64)
+        if is_buffer:
+            records = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, record_size)
+            digits = records[:, :13] - ord('0')  # Non-digit bytes wrap around to values above 9
+            well_formed = (digits <= 9).all(axis=1)
+            
+            # Fold the digits into their residue modulo the scheme's modulus instead of the full
+            # value; the residue leaves the same remainder for every modulus and fits in 32 bits
+            residue_type = np.uint32 if 13 * 255 * scheme.modulus < 2**32 else np.uint64
+            residues = (digits.astype(residue_type) @ np.array(scheme.digit_residues, dtype=residue_type)) % scheme.modulus
+            publisher_powers = 10 ** np.arange(scheme.publisher_code_end - scheme.publisher_code_start - 1, -1, -1, dtype=np.uint64)
+            publisher_codes = digits[:, scheme.publisher_code_start:scheme.publisher_code_end].astype(np.uint64) @ publisher_powers
+            values = residues.astype(np.uint64)
+        else:
+            values = np.asarray(isbns, dtype=np.uint64)
+            # Like fast_check_isbn, an integer must have exactly 13 digits
+            well_formed = (values >= 10**12) & (values < 10**13)
+            publisher_codes = values // scheme.publisher_shift % scheme.publisher_limit
+        
+        expected = publisher_codes[:, None] % moduli
+        actual = values[:, None] % moduli
+        valid = (expected == actual).all(axis=1) & well_formed
+        
+        # Malformed records have no meaningful remainders, report them as zeros like the fallback
+        expected[~well_formed] = 0
+        actual[~well_formed] = 0
+        return valid, expected, actual
+    
+    # Pure Python fallback, one fast_check_isbn per record
+    if is_buffer:
+        results = [fast_check_isbn(buffer[start:start + 13], scheme) for start in range(0, len(buffer), record_size)]
+    else:
+        results = [fast_check_isbn(int(value), scheme) if 0 <= int(value) < 10**13 else _MALFORMED for value in isbns]
+    
+    valid, expected, actual = [], [], []
+    for is_valid, publisher_code, residue in results:
+        valid.append(is_valid)
+        if publisher_code is None:
+            expected.append([0] * len(scheme.moduli))
+            actual.append([0] * len(scheme.moduli))
+        else:
+            expected.append([publisher_code % m for m in scheme.moduli])
+            actual.append([residue % m for m in scheme.moduli])
+    return valid, expected, actual
+
+def generate_isbn_with_publisher_code(publisher_code, offset=None, max_attempts=None, verbose=True):
     """
     Generate a 13-digit ISBN using the Chinese Remainder Theorem 
     with a custom publisher code.
@@ -433,7 +1675,8 @@ def generate_isbn_with_publisher_code(publisher_code, offset=None, max_attempts=
     Parameters:
     - publisher_code: A two-digit string or integer publisher code
     - offset: An offset to generate different ISBNs for the same publisher code
-    - max_attempts: Maximum number of attempts to generate a unique ISBN (default: 15015, which is 3 * 5 * 7 * 11 * 13)
+    - max_attempts: Maximum number of attempts to generate a unique ISBN (default: the scheme's modulus,
+                    15015 = 3 * 5 * 7 * 11 * 13 for the default scheme)
     - verbose: Whether to print detailed output
     
     Returns the generated 13-digit ISBN as a string, or None if no unique ISBN can be generated.
@@ -471,20 +1714,20 @@ def list_stored_isbns():
     print("\n=== Generated ISBNs in Storage ===")
     print("--------------------------------------------------")
     
-    if isbn_storage.count_isbns() == 0:
+    if get_storage().count_isbns() == 0:
         print("No ISBNs have been generated yet.")
         print("--------------------------------------------------")
         return
     
     # Display ISBNs organized by publisher code
-    for publisher_code, isbns in isbn_storage.isbns.items():
+    for publisher_code, isbns in get_storage().isbns.items():
         print(f"\nPublisher code {publisher_code} ({len(isbns)} ISBNs):")
         for i, isbn in enumerate(isbns, 1):
             # Format with hyphens for better readability
             formatted_isbn = f"{isbn[:3]}-{isbn[3:4]}-{isbn[4:6]}-{isbn[6:]}"
             print(f"  {i}. {formatted_isbn}")
     
-    print(f"\nTotal ISBNs in storage: {isbn_storage.count_isbns()}")
+    print(f"\nTotal ISBNs in storage: {get_storage().count_isbns()}")
     print("--------------------------------------------------")
 
 def generate_multiple_isbns():
@@ -510,9 +1753,9 @@ def generate_multiple_isbns():
     
     # Get the number of ISBNs to generate
     count = get_valid_input(
-        "Enter the number of ISBNs to generate (1-250)",
-        r"^([1-9]|[1-9][0-9]|1[0-9][0-9]|2[0-4][0-9]|250)$",
-        "Please enter a number between 1 and 250."
+        f"Enter the number of ISBNs to generate (1-{MAX_BATCH_SIZE})",
+        r"^([1-9]\d{0,4}|100000)$",
+        f"Please enter a number between 1 and {MAX_BATCH_SIZE}."
     )
     count = int(count)
     
@@ -530,18 +1773,14 @@ def generate_multiple_isbns():
     print("--------------------------------------------------")
     
     # Generate the ISBNs
-    generated_isbns = []
-    for i in range(count):
-        print(f"\nGenerating ISBN #{i+1}...")
-        new_isbn = generate_isbn(prefix=prefix, use_multiples=use_multiples, verbose=False)
-        
-        if new_isbn:
-            generated_isbns.append(new_isbn)
-            print(f"ISBN: {new_isbn[:3]}-{new_isbn[3:4]}-{new_isbn[4:6]}-{new_isbn[6:]}")
-        else:
-            print(f"Failed to generate ISBN #{i+1}.")
-            print("No more unique ISBNs can be generated for this prefix.")
-            break
+    generated_isbns = generate_isbns(prefix=prefix, count=count, use_multiples=use_multiples, verbose=False)
+    
+    for i, new_isbn in enumerate(generated_isbns, 1):
+        print(f"ISBN #{i}: {new_isbn[:3]}-{new_isbn[3:4]}-{new_isbn[4:6]}-{new_isbn[6:]}")
+    
+    if len(generated_isbns) < count:
+        print(f"\nFailed to generate ISBN #{len(generated_isbns)+1}.")
+        print("No more unique ISBNs can be generated for this prefix.")
     
     print("\n--------------------------------------------------")
     print(f"Successfully generated {len(generated_isbns)} ISBNs with prefix {prefix}.")
@@ -620,7 +1859,7 @@ def interactive_isbn_generation():
     
     # Ask if user wants to use multiples if previous ISBNs exist
     use_multiples = False
-    if isbn_storage.get_last_book_number(prefix) is not None:
+    if get_storage().get_last_book_number(prefix) is not None:
         use_multiples = get_valid_input(
             "Generate ISBN using multiple of previous book number? (y/n)",
             r"^[yn]$",
@@ -746,7 +1985,7 @@ def main_menu():
     print("============================================")
     print("This program implements ISBN-13 codes using")
     print("the Chinese Remainder Theorem (CRT)")
-    print(f"[Database: {isbn_storage.count_isbns()} ISBNs in storage]")
+    print(f"[Database: {get_storage().count_isbns()} ISBNs in storage]")
     
     while True:
         print("\nMenu Options:")
@@ -780,31 +2019,42 @@ if __name__ == "__main__":
     """
     # Check if we should run the automated tests or the interactive mode
     if len(sys.argv) > 1 and sys.argv[1] == "--test":
-        # For automated testing and demonstration
-        print("=== ISBN-13 CRT Generator and Validator (Test Mode) ===\n")
-        
-        # Display the number of previously generated ISBNs
-        print(f"Found {isbn_storage.count_isbns()} previously generated ISBNs in storage.")
-        
-        # Test generating multiple ISBNs with the same prefix
-        prefix = "978316"
-        num_to_generate = 10
-        print(f"\nGenerating {num_to_generate} unique ISBNs with prefix {prefix}...")
-        
-        for i in range(num_to_generate):
-            print(f"\nGenerating ISBN #{i+1}:")
-            new_isbn = generate_isbn(prefix=prefix)
-            if new_isbn:
-                print(f"Generated ISBN: {new_isbn}")
-                sys.stdout.flush()
-            else:
-                print(f"Failed to generate ISBN #{i+1}.")
-                break
-        
-        # List all stored ISBNs
-        list_stored_isbns()
-        
-        print("\nTest mode completed successfully.")
+        # Profile the run with --profile (cProfile) or --profile=memory (tracemalloc), or through ISBN_PROFILE
+        from isbn_profiling import profiling, PROFILE_MODE
+        profile_mode = PROFILE_MODE
+        for arg in sys.argv[2:]:
+            if arg == "--profile" or arg.startswith("--profile="):
+                profile_mode = arg.partition("=")[2] or "cpu"
+        
+        with profiling("isbn13_crt_test", profile_mode) as profile_result:
+            # For automated testing and demonstration
+            print("=== ISBN-13 CRT Generator and Validator (Test Mode) ===\n")
+            
+            # Display the number of previously generated ISBNs
+            print(f"Found {get_storage().count_isbns()} previously generated ISBNs in storage.")
+            
+            # Test generating multiple ISBNs with the same prefix
+            prefix = "978316"
+            num_to_generate = 10
+            print(f"\nGenerating {num_to_generate} unique ISBNs with prefix {prefix}...")
+            
+            for i in range(num_to_generate):
+                print(f"\nGenerating ISBN #{i+1}:")
+                new_isbn = generate_isbn(prefix=prefix)
+                if new_isbn:
+                    print(f"Generated ISBN: {new_isbn}")
+                    sys.stdout.flush()
+                else:
+                    print(f"Failed to generate ISBN #{i+1}.")
+                    break
+            
+            # List all stored ISBNs
+            list_stored_isbns()
+            
+            print("\nTest mode completed successfully.")
+        
+        if profile_result:
+            print(f"Profile written to {', '.join(profile_result.paths)}")
     else:
         # Run the interactive mode
         main_menu() 
\ No newline at end of file
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import isbn13_crt
+
+# Largest number of ISBNs a single job may request
+MAX_JOB_SIZE = 1000000
+
+# Number of ISBNs generated per storage transaction; the lock is released between chunks
+JOB_CHUNK_SIZE = 1000
+
+# Number of jobs run at the same time
+JOB_WORKERS = int(os.environ.get("ISBN_JOB_WORKERS", "2"))
+
+# Number of finished jobs kept for polling before the oldest ones are discarded
+JOB_HISTORY = int(os.environ.get("ISBN_JOB_HISTORY", "100"))
+
+# Seconds a finished job and its ISBNs are kept for download
+JOB_RESULT_TTL = int(os.environ.get("ISBN_JOB_RESULT_TTL", "3600"))
+
+class BatchJob:
+    """
+    A batch of ISBNs generated in the background.
+    
+    The job generates its ISBNs in chunks of JOB_CHUNK_SIZE, so other requests can
+    use the storage in between and the ISBNs generated so far can be read while the
+    job is still running. The ISBNs are held in an ISBNList, 8 bytes each, so a job
+    of MAX_JOB_SIZE ISBNs takes 8 MB.
+    """
+    def __init__(self, prefix, count, use_multiples=True):
+        self.id = uuid.uuid4().hex
+        self.prefix = prefix
+        self.count = count
+        self.use_multiples = use_multiples
+        self.status = 'queued'
+        self.error = None
+        self.isbns = isbn13_crt.ISBNList()
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancelled = False
+    
+    @property
+    def finished(self):
+        """Whether the job has stopped, successfully or not."""
+        return self.status in ('done', 'failed', 'cancelled')
+    
+    def cancel(self):
+        """Ask the job to stop after the chunk it is currently generating."""
+        self._cancelled = True
+        if self.status == 'queued':
+            self.status = 'cancelled'
+            self.finished_at = time.time()
+    
+    def run(self):
+        """Generate the ISBNs of the job; called on a worker thread."""
+        if self._cancelled:
+            return
+        self.status = 'running'
+        try:
+            while len(self.isbns) < self.count and not self._cancelled:
+                chunk_size = min(JOB_CHUNK_SIZE, self.count - len(self.isbns))
+                chunk = isbn13_crt.generate_isbns(self.prefix, chunk_size, use_multiples=self.use_multiples)
+                if not chunk:
+                    # The prefix has run out of unique ISBNs
+                    break
+                # Extending the list is atomic, so readers always see whole chunks
+                self.isbns.extend(chunk)
+            self.status = 'cancelled' if self._cancelled else 'done'
+        except Exception as e:
+            self.error = str(e)
+            self.status = 'failed'
+        self.finished_at = time.time()
+    
+    def to_dict(self):
+        """Return the status of the job as a JSON-serializable dictionary."""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'prefix': self.prefix,
+            'requested': self.count,
+            'generated': len(self.isbns),
+            'progress': len(self.isbns) / self.count,
+            'error': self.error
+        }
+
+class JobManager:
+    """
+    Runs BatchJobs on a thread pool and keeps them available for polling.
+    
+    Jobs only live in the memory of the process that created them, so with several
+    web server processes the status has to be polled from the same process. Finished
+    jobs are discarded once they are older than the TTL or beyond the history limit.
+    """
+    def __init__(self, max_workers=JOB_WORKERS, history=JOB_HISTORY, ttl=JOB_RESULT_TTL):
+        self.history = history
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='isbn-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def submit(self, prefix, count, use_multiples=True):
+        """
+        Queue a new batch generation job.
+        
+        Parameters:
+        - prefix: The 6-digit prefix
+        - count: The number of ISBNs to generate (at most MAX_JOB_SIZE)
+        - use_multiples: Whether to use multiples of the last book number (if available)
+        
+        Returns the queued BatchJob.
+        """
+        if count < 1 or count > MAX_JOB_SIZE:
+            raise ValueError(f"Count must be between 1 and {MAX_JOB_SIZE}")
+        
+        job = BatchJob(prefix, count, use_multiples)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(job.run)
+        return job
+    
+    def get(self, job_id):
+        """Return the job with the given id, or None if it does not exist (anymore)."""
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+    
+    def _prune(self):
+        """Discard finished jobs older than the TTL and the oldest ones beyond the history limit."""
+        expired_before = time.time() - self.ttl
+        finished = []
+        for job_id, job in list(self._jobs.items()):
+            if not job.finished:
+                continue
+            # The finish time is set just after the final status
+            if job.finished_at is not None and job.finished_at <= expired_before:
+                del self._jobs[job_id]
+            else:
+                finished.append(job_id)
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+    
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and optionally wait for the running ones."""
+        self._executor.shutdown(wait=wait)
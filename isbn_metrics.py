@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+import bisect
+import os
+import threading
+import time
+
+# Whether metrics are recorded; set ISBN_METRICS=1 to enable them
+METRICS_ENABLED = os.environ.get("ISBN_METRICS", "0").lower() in ("1", "true", "yes", "on")
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _format_labels(label_names, label_values, extra=()):
+    """Format label names and values as a Prometheus label set."""
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    """Format a sample value the way Prometheus expects."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    """
+    A monotonically increasing count, kept per combination of label values.
+    """
+    def __init__(self, registry, name, documentation, label_names=()):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *label_values, amount=1):
+        """Add to the count of the given label values; does nothing while metrics are disabled."""
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+    
+    def value(self, *label_values):
+        """Return the current count of the given label values."""
+        return self._values.get(label_values, 0)
+    
+    def render(self):
+        """Return the Prometheus text lines of the counter."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+    
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class _Timer:
+    """Context manager that observes the time spent inside it in a histogram."""
+    __slots__ = ('_histogram', '_label_values', '_start')
+    
+    def __init__(self, histogram, label_values):
+        self._histogram = histogram
+        self._label_values = label_values
+    
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, *self._label_values)
+        return False
+
+class _NullTimer:
+    """Stand-in for _Timer while metrics are disabled."""
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class Histogram:
+    """
+    A distribution of observed values (normally durations in seconds), kept per
+    combination of label values as cumulative bucket counts, a sum and a count.
+    """
+    def __init__(self, registry, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        """Record a value for the given label values; does nothing while metrics are disabled."""
+        if not self._registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # Per-bucket counts (the last one for +Inf), the sum and the count
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+    
+    def time(self, *label_values):
+        """Return a context manager that observes the time spent inside it."""
+        if not self._registry.enabled:
+            return _NULL_TIMER
+        return _Timer(self, label_values)
+    
+    def count(self, *label_values):
+        """Return the number of values observed for the given label values."""
+        state = self._values.get(label_values)
+        return state[2] if state else 0
+    
+    def render(self):
+        """Return the Prometheus text lines of the histogram."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, label_values, [('le', _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+    
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class MetricsRegistry:
+    """
+    The set of metrics of the process, rendered together in the Prometheus text format.
+    
+    While the registry is disabled, recording a metric returns after a single attribute
+    check, so instrumented code runs at practically full speed.
+    """
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = []
+    
+    def counter(self, name, documentation, label_names=()):
+        """Create and register a Counter."""
+        metric = Counter(self, name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        """Create and register a Histogram."""
+        metric = Histogram(self, name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+    
+    def reset(self):
+        """Clear the recorded values of every metric."""
+        for metric in self._metrics:
+            metric.reset()
+
+# The registry of this process
+registry = MetricsRegistry()
+
+# Metrics of ISBN generation, validation and storage
+ISBNS_ISSUED = registry.counter("isbn_issued_total", "ISBNs generated and stored", ["prefix"])
+SLOT_COLLISIONS = registry.counter(
+    "isbn_slot_collisions_total", "Candidate book numbers that landed on an already used slot", ["prefix"]
+)
+MULTIPLE_ATTEMPTS = registry.counter(
+    "isbn_multiple_attempts_total", "Multiples of a previous book number tried by the multiples method", ["prefix"]
+)
+OFFSET_FALLBACKS = registry.counter(
+    "isbn_offset_fallbacks_total", "Times the multiples method found no free slot and the offset method was used", ["prefix"]
+)
+PREFIXES_EXHAUSTED = registry.counter(
+    "isbn_prefix_exhausted_total", "Generation requests refused because every slot of the prefix is used", ["prefix"]
+)
+VALIDATIONS = registry.counter("isbn_validations_total", "ISBNs checked by check_isbn", ["result"])
+STAGE_SECONDS = registry.histogram("isbn_stage_seconds", "Time spent in each stage of ISBN generation and storage", ["stage"])
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "isbn_http_request_seconds", "Latency of the HTTP API by endpoint and status", ["endpoint", "status"]
+)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+import mmap
+import os
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+from isbn13_crt import ISBNStorage, SlotAllocator, DEFAULT_SCHEME, fcntl, MMAP_STORAGE_SUFFIX
+
+# File header: magic, format version, number of prefix records, record size and the
+# product of the scheme's moduli (0 in files written before it was recorded, meaning 15015)
+HEADER = struct.Struct('<8sIIII8x')
+MAGIC = b'ISBNMAP\x00'
+VERSION = 1
+
+# GS1 prefixes that have a record in the file; each has one record per country and publisher code
+GS1_PREFIXES = ('978', '979')
+PREFIXES_PER_GS1 = 1000
+RECORD_COUNT = len(GS1_PREFIXES) * PREFIXES_PER_GS1
+
+# Record header: number of used slots, last used offset and last book number (-1 when unset)
+RECORD_HEADER = struct.Struct('<Iii')
+
+def get_bitmap_bytes(scheme):
+    """Return the bytes needed for a bitmap with one bit per possible slot of a prefix."""
+    return (scheme.max_slots + 7) // 8
+
+class MmapSlotAllocator(SlotAllocator):
+    """
+    SlotAllocator whose bitmap and used slot count live in a memory-mapped record.
+    
+    Every change to the allocator is written straight to the mapped pages, so there
+    is nothing to load on startup and nothing to save afterwards.
+    """
+    def __init__(self, mapped, record_offset, capacity, bitmap_bytes):
+        self._mapped = mapped
+        self._record_offset = record_offset
+        self._bitmap_offset = record_offset + RECORD_HEADER.size
+        self._bitmap_bytes = bitmap_bytes
+        self.capacity = capacity
+        self._full_mask = (1 << capacity) - 1
+    
+    @property
+    def bitmap(self):
+        return int.from_bytes(self._mapped[self._bitmap_offset:self._bitmap_offset + self._bitmap_bytes], 'little')
+    
+    @bitmap.setter
+    def bitmap(self, value):
+        self._mapped[self._bitmap_offset:self._bitmap_offset + self._bitmap_bytes] = value.to_bytes(self._bitmap_bytes, 'little')
+    
+    @property
+    def used_count(self):
+        return struct.unpack_from('<I', self._mapped, self._record_offset)[0]
+    
+    @used_count.setter
+    def used_count(self, value):
+        struct.pack_into('<I', self._mapped, self._record_offset, value)
+    
+    def is_used(self, slot):
+        """Return True if the slot has already been used."""
+        byte = self._mapped[self._bitmap_offset + (slot >> 3)]
+        return bool(byte >> (slot & 7) & 1)
+    
+    def mark_used(self, slot):
+        """Mark a slot as used."""
+        position = self._bitmap_offset + (slot >> 3)
+        byte = self._mapped[position]
+        if not byte >> (slot & 7) & 1:
+            self._mapped[position] = byte | 1 << (slot & 7)
+            self.used_count += 1
+
+class MmapISBNStorage:
+    """
+    ISBN storage backed by a memory-mapped file of per-prefix slot bitmaps.
+    
+    Every ISBN generated by this program is a slot of its prefix (see PrefixSlots), so
+    an ISBN takes a single bit instead of a 13-character JSON string. The file holds
+    one fixed-size record per GS1 prefix, country code and publisher code, addressed
+    directly by the prefix digits, so opening the storage does not read any ISBNs and
+    lookups go straight to the mapped pages.
+    
+    It offers the same methods as ISBNStorage. Only prefixes starting with 978 or 979
+    are supported, and only ISBNs that satisfy the CRT conditions can be stored.
+    Processes mapping the same file see each other's changes immediately, and
+    transaction() locks the file itself to serialize allocations between them.
+    
+    The record size follows from the scheme's moduli, so a file can only be opened
+    with the scheme it was created with. The scheme must use 6-digit prefixes.
+    """
+    def __init__(self, storage_file, scheme=None):
+        self.storage_file = storage_file
+        self.scheme = scheme or DEFAULT_SCHEME
+        if self.scheme.prefix_length != 6:
+            raise ValueError("ISBN map files only support schemes with 6-digit prefixes")
+        self._bitmap_bytes = get_bitmap_bytes(self.scheme)
+        self._record_size = RECORD_HEADER.size + self._bitmap_bytes
+        
+        if not os.path.exists(storage_file):
+            self._create_file(storage_file)
+        
+        self._file = open(storage_file, 'r+b')
+        self._mapped = mmap.mmap(self._file.fileno(), 0)
+        
+        magic, version, record_count, record_size, modulus = HEADER.unpack_from(self._mapped, 0)
+        if magic != MAGIC or version != VERSION or record_count != RECORD_COUNT:
+            self.close()
+            raise ValueError(f"{storage_file} is not a version {VERSION} ISBN map file")
+        if record_size != self._record_size or (modulus or 15015) != self.scheme.modulus:
+            self.close()
+            raise ValueError(f"{storage_file} was created with a different ISBN scheme than {self.scheme}")
+        self._allocators = {}
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._add_listeners = []
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the storage lock while allocating and storing ISBNs.
+        
+        The lock is held against other threads and, by locking the storage file, against
+        other processes. Transactions can be nested.
+        """
+        with self._lock:
+            if self._transaction_depth == 0 and fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+    
+    def _create_file(self, storage_file):
+        """
+        Create an empty storage file with every record unset.
+        
+        The file is written under a temporary name and linked into place, so processes
+        starting at the same time never map a half-written file or overwrite one that
+        another process has already created and started using.
+        """
+        empty_record = RECORD_HEADER.pack(0, -1, -1) + bytes(self._bitmap_bytes)
+        temp_file = f"{storage_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD_COUNT, self._record_size, self.scheme.modulus))
+            f.write(empty_record * RECORD_COUNT)
+        try:
+            os.link(temp_file, storage_file)
+        except FileExistsError:
+            pass  # Another process created the file first
+        finally:
+            os.remove(temp_file)
+    
+    def close(self):
+        """Flush and unmap the storage file."""
+        self._mapped.flush()
+        self._mapped.close()
+        self._file.close()
+    
+    def compact(self):
+        """Flush the mapped pages to disk."""
+        self._mapped.flush()
+    
+    def _record_offset(self, prefix):
+        """
+        Find the file offset of the record of a prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns the byte offset of the prefix's record.
+        """
+        gs1 = prefix[:3]
+        if gs1 not in GS1_PREFIXES or not prefix[3:6].isdigit():
+            raise ValueError(f"Prefix {prefix} cannot be stored in an ISBN map file")
+        return HEADER.size + (GS1_PREFIXES.index(gs1) * PREFIXES_PER_GS1 + int(prefix[3:6])) * self._record_size
+    
+    def _iter_prefixes(self):
+        """Yield every prefix that has at least one ISBN stored."""
+        for gs1 in GS1_PREFIXES:
+            for code in range(PREFIXES_PER_GS1):
+                prefix = f"{gs1}{code:03d}"
+                if struct.unpack_from('<I', self._mapped, self._record_offset(prefix))[0]:
+                    yield prefix
+    
+    def get_slot_allocator(self, prefix):
+        """
+        Get the allocator tracking the used book number slots of a prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The MmapSlotAllocator for the prefix
+        """
+        allocator = self._allocators.get(prefix)
+        if allocator is None:
+            allocator = MmapSlotAllocator(
+                self._mapped, self._record_offset(prefix), len(self.scheme.slots(prefix)), self._bitmap_bytes
+            )
+            self._allocators[prefix] = allocator
+        return allocator
+    
+    def remaining_capacity(self, prefix):
+        """Return the number of ISBNs that can still be generated with a prefix."""
+        return self.get_slot_allocator(prefix).free_count
+    
+    def add_listener(self, callback):
+        """
+        Register a function to call whenever ISBNs are added to the storage.
+        
+        The callback receives the list of added ISBNs. ISBNs added by other processes
+        mapping the same file are not reported.
+        """
+        self._add_listeners.append(callback)
+    
+    def refresh(self):
+        """
+        Do nothing; the mapped pages always show the ISBNs of other processes.
+        
+        The file keeps no change counter, so additions by other processes cannot be
+        reported to the listeners.
+        """
+    
+    def remove_listener(self, callback):
+        """Stop calling a function registered with add_listener; does nothing if it is not registered."""
+        if callback in self._add_listeners:
+            self._add_listeners.remove(callback)
+    
+    def _notify_added(self, isbns):
+        """Pass newly added ISBNs to the registered listeners."""
+        for listener in self._add_listeners:
+            listener(isbns)
+    
+    def add_isbn(self, publisher_code, isbn, prefix, offset):
+        """
+        Add a newly generated ISBN to storage and update offset tracking.
+        
+        Parameters:
+        - publisher_code: The publisher code associated with the ISBN (implied by the prefix)
+        - isbn: The full 13-digit ISBN
+        - prefix: The prefix used to generate the ISBN
+        - offset: The offset used to generate the ISBN
+        """
+        book_number = int(isbn[6:])
+        slot = self.scheme.slots(isbn[:6]).slot_of(book_number)
+        if slot is None:
+            raise ValueError(f"ISBN {isbn} does not satisfy the CRT conditions and cannot be stored")
+        
+        self.get_slot_allocator(isbn[:6]).mark_used(slot)
+        
+        # Update the last used offset and book number for this prefix
+        record_offset = self._record_offset(prefix)
+        struct.pack_into('<ii', self._mapped, record_offset + 4, offset, book_number)
+        self._notify_added([isbn])
+    
+    def add_isbns(self, records):
+        """
+        Add a batch of newly generated ISBNs to storage.
+        
+        Parameters:
+        - records: A list of (publisher_code, isbn, prefix, offset) tuples, as accepted by add_isbn
+        """
+        for publisher_code, isbn, prefix, offset in records:
+            self.add_isbn(publisher_code, isbn, prefix, offset)
+    
+    def get_next_offset(self, prefix):
+        """
+        Get the next offset to try for a specific prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The next offset to try (one more than the last used offset, or 0 if no ISBN has been generated for this prefix)
+        """
+        current_offset = struct.unpack_from('<i', self._mapped, self._record_offset(prefix) + 4)[0]
+        return (current_offset + 1) % len(self.scheme.slots(prefix))
+    
+    def is_isbn_generated(self, isbn):
+        """
+        Check if an ISBN has already been generated.
+        
+        Parameters:
+        - isbn: The ISBN to check
+        
+        Returns:
+        - True if the ISBN exists in storage, False otherwise
+        """
+        isbn = str(isbn)
+        try:
+            record_offset = self._record_offset(isbn[:6])
+        except ValueError:
+            return False
+        slot = self.scheme.slots(isbn[:6]).slot_of(int(isbn[6:]))
+        if slot is None:
+            return False
+        byte = self._mapped[record_offset + RECORD_HEADER.size + (slot >> 3)]
+        return bool(byte >> (slot & 7) & 1)
+    
+    def _list_isbns_for_prefix(self, prefix):
+        """List the ISBNs stored for a prefix, in slot order."""
+        slots = self.scheme.slots(prefix)
+        bitmap = self.get_slot_allocator(prefix).bitmap
+        isbns = []
+        while bitmap:
+            lowest = bitmap & -bitmap
+            isbns.append(slots.isbn(lowest.bit_length() - 1))
+            bitmap ^= lowest
+        return isbns
+    
+    def list_isbns_for_publisher(self, publisher_code):
+        """
+        List all ISBNs generated for a specific publisher code.
+        
+        Parameters:
+        - publisher_code: The publisher code to check
+        
+        Returns:
+        - List of ISBNs for the given publisher code
+        """
+        publisher_code = int(publisher_code)
+        isbns = []
+        for prefix in self._iter_prefixes():
+            if self.scheme.publisher_code(prefix) == publisher_code:
+                isbns.extend(self._list_isbns_for_prefix(prefix))
+        return isbns
+    
+    def count_isbns_for_prefix(self, prefix):
+        """
+        Count the ISBNs generated with a specific prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The number of stored ISBNs starting with the prefix
+        """
+        return self.get_slot_allocator(prefix).used_count
+    
+    def count_isbns(self):
+        """Return the total number of generated ISBNs."""
+        count = 0
+        for i in range(RECORD_COUNT):
+            count += struct.unpack_from('<I', self._mapped, HEADER.size + i * self._record_size)[0]
+        return count
+    
+    @property
+    def isbns(self):
+        """Dictionary of ISBNs by publisher code, built from the bitmaps for compatibility with ISBNStorage."""
+        isbns = {}
+        for publisher_code, isbn in self.iter_isbns():
+            isbns.setdefault(publisher_code, []).append(isbn)
+        return isbns
+    
+    def iter_isbns(self):
+        """Yield a (publisher_code, isbn) tuple for every stored ISBN, prefix by prefix."""
+        for prefix in self._iter_prefixes():
+            publisher_code = str(self.scheme.publisher_code(prefix))
+            for isbn in self._list_isbns_for_prefix(prefix):
+                yield publisher_code, isbn
+    
+    def get_last_book_number(self, prefix):
+        """
+        Get the book number (last 7 digits) of the last ISBN generated with this prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The book number (last 7 digits) as an integer, or None if no ISBN has been generated for this prefix
+        """
+        book_number = struct.unpack_from('<i', self._mapped, self._record_offset(prefix) + 8)[0]
+        return None if book_number < 0 else book_number
+
+def convert_json_storage(json_file, map_file, scheme=None):
+    """
+    Convert a JSON ISBN storage file (and its journal) into an ISBN map file.
+    
+    Parameters:
+    - json_file: The JSON storage file to read
+    - map_file: The ISBN map file to create or add to
+    - scheme: The ISBNScheme of the stored ISBNs (default: DEFAULT_SCHEME)
+    
+    Returns a tuple (converted, skipped) with the number of ISBNs written and the number
+    of ISBNs that could not be represented (invalid ISBNs or unsupported prefixes).
+    """
+    source = ISBNStorage(json_file, scheme=scheme)
+    target = MmapISBNStorage(map_file, scheme)
+    converted = 0
+    skipped = 0
+    try:
+        for publisher_code, isbns in source.isbns.items():
+            for isbn in isbns:
+                try:
+                    # Storing the ISBNs in their original order leaves the most recent one as the last book number
+                    target.add_isbn(publisher_code, isbn, isbn[:6], source.data['prefix_offsets'].get(isbn[:6], 0))
+                    converted += 1
+                except ValueError:
+                    skipped += 1
+    finally:
+        target.close()
+    return converted, skipped
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Convert a JSON ISBN storage file into a memory-mapped ISBN map file")
+        print(f"Usage: python isbn_mmap_storage.py generated_isbns.json generated_isbns{MMAP_STORAGE_SUFFIX}")
+        sys.exit(1)
+    
+    converted, skipped = convert_json_storage(sys.argv[1], sys.argv[2])
+    print(f"Converted {converted} ISBNs into {sys.argv[2]}.")
+    if skipped:
+        print(f"Skipped {skipped} ISBNs that do not satisfy the CRT conditions or use an unsupported prefix.")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Profiling modes: "cpu" runs under cProfile, "memory" under tracemalloc
+PROFILE_MODES = ("cpu", "memory")
+
+# Mode used by the command line tools when no flag is given; empty disables profiling
+PROFILE_MODE = os.environ.get("ISBN_PROFILE", "")
+
+# Directory the profile dumps are written to
+PROFILE_DIR = os.environ.get("ISBN_PROFILE_DIR", "profiles")
+
+# Number of frames tracemalloc keeps per allocation
+TRACEMALLOC_FRAMES = 25
+
+# Number of entries in the text summaries
+SUMMARY_LINES = 50
+
+# cProfile allows one active profiler per process, so profiled runs take turns
+_profile_lock = threading.Lock()
+
+class ProfileResult:
+    """
+    The output of a profiled run, filled in when the run finishes.
+    
+    Attributes:
+    - name: The name of the run
+    - mode: "cpu" or "memory"
+    - paths: The files written, the binary dump first and the text summary second
+    - seconds: The wall clock duration of the run
+    """
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.paths = []
+        self.seconds = None
+
+def _output_base(name, output_dir):
+    """Return a unique path, without extension, for the dumps of a run."""
+    os.makedirs(output_dir, exist_ok=True)
+    safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name).strip('_') or 'run'
+    return os.path.join(output_dir, f"{safe_name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{time.perf_counter_ns()}")
+
+def _dump_cpu_profile(profiler, base):
+    """
+    Write the stats of a cProfile run.
+    
+    The .prof file is the standard pstats format, which snakeviz, flameprof and
+    gprof2dot turn into flame graphs and call graphs; the .txt file lists the most
+    expensive functions by cumulative time.
+    """
+    stats_path = f"{base}.prof"
+    profiler.dump_stats(stats_path)
+    
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    summary_path = f"{base}.txt"
+    with open(summary_path, 'w') as f:
+        f.write(summary.getvalue())
+    return [stats_path, summary_path]
+
+def _dump_memory_profile(snapshot, peak, base):
+    """
+    Write a tracemalloc snapshot.
+    
+    The .tracemalloc file can be reloaded with tracemalloc.Snapshot.load to compare
+    runs; the .txt file lists the allocation sites holding the most memory.
+    """
+    snapshot_path = f"{base}.tracemalloc"
+    snapshot.dump(snapshot_path)
+    
+    summary_path = f"{base}.txt"
+    with open(summary_path, 'w') as f:
+        f.write(f"Peak traced memory: {peak} bytes\n\n")
+        for stat in snapshot.statistics('lineno')[:SUMMARY_LINES]:
+            f.write(f"{stat}\n")
+    return [snapshot_path, summary_path]
+
+@contextmanager
+def profiling(name, mode=PROFILE_MODE, output_dir=PROFILE_DIR):
+    """
+    Profile the code run inside the with block and write the dumps to a directory.
+    
+    Parameters:
+    - name: Name of the run, used in the dump file names
+    - mode: "cpu", "memory", or empty to run without profiling (default: ISBN_PROFILE)
+    - output_dir: Directory to write the dumps to (default: ISBN_PROFILE_DIR or "profiles")
+    
+    Yields a ProfileResult whose paths are set once the block exits, or None if profiling is off.
+    """
+    if not mode:
+        yield None
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Profile mode must be one of {', '.join(PROFILE_MODES)}")
+    
+    result = ProfileResult(name, mode)
+    with _profile_lock:
+        start = time.perf_counter()
+        if mode == 'cpu':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield result
+            finally:
+                profiler.disable()
+                result.seconds = time.perf_counter() - start
+                result.paths = _dump_cpu_profile(profiler, _output_base(name, output_dir))
+        else:
+            # Leave tracing running if someone else started it
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+            try:
+                yield result
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                if started:
+                    tracemalloc.stop()
+                result.seconds = time.perf_counter() - start
+                result.paths = _dump_memory_profile(snapshot, peak, _output_base(name, output_dir))
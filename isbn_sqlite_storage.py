@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+import sqlite3
+import threading
+from contextlib import contextmanager
+from isbn13_crt import SlotAllocator, DEFAULT_SCHEME
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS isbns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    isbn TEXT NOT NULL UNIQUE,
+    publisher_code TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    book_number INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS isbns_prefix ON isbns (prefix, id);
+CREATE INDEX IF NOT EXISTS isbns_publisher_code ON isbns (publisher_code, id);
+CREATE TABLE IF NOT EXISTS prefix_offsets (
+    prefix TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+"""
+
+# Seconds a connection waits for another process to release a write lock
+BUSY_TIMEOUT = 30
+
+class SQLiteISBNStorage:
+    """
+    ISBN storage backed by a local SQLite database.
+    
+    ISBNs are rows with a unique index on the ISBN and an index on the prefix, so
+    membership checks, counts and per-prefix lookups are indexed queries instead of
+    scans of an in-memory dictionary. The database runs in WAL mode, which lets
+    several Flask worker processes share one store: readers never block the writer
+    and the unique index rejects duplicate ISBNs. transaction() takes the database
+    write lock up front, so slots allocated inside it cannot be taken concurrently.
+    
+    It offers the same methods as ISBNStorage.
+    """
+    def __init__(self, storage_file, scheme=None):
+        self.storage_file = storage_file
+        self.scheme = scheme or DEFAULT_SCHEME
+        self._local = threading.local()
+        self._add_listeners = []
+        
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+    
+    def _connection(self):
+        """Get the database connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; writes are grouped with explicit transactions
+            connection = sqlite3.connect(self.storage_file, timeout=BUSY_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the database write lock while allocating and storing ISBNs.
+        
+        Everything stored inside the transaction is committed together when it ends, or
+        rolled back if it raises. Transactions can be nested.
+        """
+        connection = self._connection()
+        if connection.in_transaction:
+            yield self
+            return
+        
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    
+    def close(self):
+        """Close the database connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+    
+    def compact(self):
+        """Fold the write-ahead log back into the database file."""
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    def get_slot_allocator(self, prefix):
+        """
+        Get an allocator with the used book number slots of a prefix.
+        
+        The allocator is built from the database on every call, so it includes ISBNs
+        added by other processes.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - A SlotAllocator for the prefix
+        """
+        slots = self.scheme.slots(prefix)
+        allocator = SlotAllocator(len(slots))
+        rows = self._connection().execute("SELECT book_number FROM isbns WHERE prefix = ?", (prefix,))
+        for (book_number,) in rows:
+            slot = slots.slot_of(book_number)
+            if slot is not None:
+                allocator.mark_used(slot)
+        return allocator
+    
+    def remaining_capacity(self, prefix):
+        """Return the number of ISBNs that can still be generated with a prefix."""
+        return self.get_slot_allocator(prefix).free_count
+    
+    def add_listener(self, callback):
+        """
+        Register a function to call whenever ISBNs are added to the storage.
+        
+        The callback receives the list of added ISBNs, or None when refresh() finds that
+        another connection changed the database and any ISBN may have been added.
+        """
+        self._add_listeners.append(callback)
+    
+    def refresh(self):
+        """Tell the listeners that any ISBN may have been added if another connection wrote to the database."""
+        # data_version only changes when other connections commit
+        version = self._connection().execute("PRAGMA data_version").fetchone()[0]
+        if version != getattr(self._local, 'data_version', None):
+            self._local.data_version = version
+            self._notify_added(None)
+    
+    def remove_listener(self, callback):
+        """Stop calling a function registered with add_listener; does nothing if it is not registered."""
+        if callback in self._add_listeners:
+            self._add_listeners.remove(callback)
+    
+    def _notify_added(self, isbns):
+        """Pass newly added ISBNs to the registered listeners."""
+        for listener in self._add_listeners:
+            listener(isbns)
+    
+    def add_isbn(self, publisher_code, isbn, prefix, offset):
+        """
+        Add a newly generated ISBN to storage and update offset tracking.
+        
+        Parameters:
+        - publisher_code: The publisher code associated with the ISBN
+        - isbn: The full 13-digit ISBN
+        - prefix: The prefix used to generate the ISBN
+        - offset: The offset used to generate the ISBN
+        
+        Raises sqlite3.IntegrityError if the ISBN is already stored.
+        """
+        self.add_isbns([(publisher_code, isbn, prefix, offset)])
+    
+    def add_isbns(self, records):
+        """
+        Add a batch of newly generated ISBNs to storage in a single transaction.
+        
+        Parameters:
+        - records: A list of (publisher_code, isbn, prefix, offset) tuples, as accepted by add_isbn
+        
+        Raises sqlite3.IntegrityError, without adding any of the ISBNs, if one of them is already stored.
+        """
+        if not records:
+            return
+        
+        prefix_length = self.scheme.prefix_length
+        with self.transaction():
+            connection = self._connection()
+            connection.executemany(
+                "INSERT INTO isbns (isbn, publisher_code, prefix, book_number) VALUES (?, ?, ?, ?)",
+                [(isbn, str(publisher_code), isbn[:prefix_length], int(isbn[prefix_length:]))
+                 for publisher_code, isbn, prefix, offset in records]
+            )
+            
+            # Update the last used offset of each prefix
+            offsets = {}
+            for publisher_code, isbn, prefix, offset in records:
+                offsets[prefix] = offset
+            connection.executemany("INSERT OR REPLACE INTO prefix_offsets (prefix, offset) VALUES (?, ?)", offsets.items())
+        self._notify_added([isbn for publisher_code, isbn, prefix, offset in records])
+    
+    def get_next_offset(self, prefix):
+        """
+        Get the next offset to try for a specific prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The next offset to try (one more than the last used offset, or 0 if no ISBN has been generated for this prefix)
+        """
+        row = self._connection().execute("SELECT offset FROM prefix_offsets WHERE prefix = ?", (prefix,)).fetchone()
+        current_offset = row[0] if row else -1
+        return (current_offset + 1) % len(self.scheme.slots(prefix))
+    
+    def is_isbn_generated(self, isbn):
+        """
+        Check if an ISBN has already been generated.
+        
+        Parameters:
+        - isbn: The ISBN to check
+        
+        Returns:
+        - True if the ISBN exists in storage, False otherwise
+        """
+        row = self._connection().execute("SELECT 1 FROM isbns WHERE isbn = ?", (str(isbn),)).fetchone()
+        return row is not None
+    
+    def list_isbns_for_publisher(self, publisher_code):
+        """
+        List all ISBNs generated for a specific publisher code.
+        
+        Parameters:
+        - publisher_code: The publisher code to check
+        
+        Returns:
+        - List of ISBNs for the given publisher code
+        """
+        rows = self._connection().execute(
+            "SELECT isbn FROM isbns WHERE publisher_code = ? ORDER BY id", (str(publisher_code),)
+        )
+        return [isbn for (isbn,) in rows]
+    
+    def count_isbns_for_prefix(self, prefix):
+        """
+        Count the ISBNs generated with a specific prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The number of stored ISBNs starting with the prefix
+        """
+        return self._connection().execute("SELECT COUNT(*) FROM isbns WHERE prefix = ?", (prefix,)).fetchone()[0]
+    
+    def count_isbns(self):
+        """Return the total number of generated ISBNs."""
+        return self._connection().execute("SELECT COUNT(*) FROM isbns").fetchone()[0]
+    
+    @property
+    def isbns(self):
+        """Dictionary of ISBNs by publisher code, for compatibility with ISBNStorage."""
+        isbns = {}
+        for publisher_code, isbn in self.iter_isbns():
+            isbns.setdefault(publisher_code, []).append(isbn)
+        return isbns
+    
+    def iter_isbns(self):
+        """Yield a (publisher_code, isbn) tuple for every stored ISBN, in the order they were added."""
+        yield from self._connection().execute("SELECT publisher_code, isbn FROM isbns ORDER BY id")
+    
+    def get_last_book_number(self, prefix):
+        """
+        Get the book number (last 7 digits) of the last ISBN generated with this prefix.
+        
+        Parameters:
+        - prefix: The ISBN prefix (first 6 digits)
+        
+        Returns:
+        - The book number (last 7 digits) as an integer, or None if no ISBN has been generated for this prefix
+        """
+        row = self._connection().execute(
+            "SELECT book_number FROM isbns WHERE prefix = ? ORDER BY id DESC LIMIT 1", (prefix,)
+        ).fetchone()
+        return row[0] if row else None
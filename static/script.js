@@ -147,8 +147,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const count = parseInt(document.getElementById('batch-count').value) || 10;
         const useMultiples = document.getElementById('batch-use-multiples').checked;
         
-        if (count < 1 || count > 250) {
-            alert('Please enter a number between 1 and 250');
+        if (count < 1 || count > 1000000) {
+            alert('Please enter a number between 1 and 1000000');
             return;
         }
         
@@ -157,7 +157,8 @@ document.addEventListener('DOMContentLoaded', function() {
             batchGenerateBtn.textContent = 'Generating...';
             batchGenerateBtn.disabled = true;
             
-            const response = await fetch('/api/batch-generate', {
+            // Start a background job, so large batches do not hold the request open
+            const response = await fetch('/api/batch-jobs', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -170,7 +171,27 @@ document.addEventListener('DOMContentLoaded', function() {
                 })
             });
             
-            const data = await response.json();
+            let job = await response.json();
+            if (!response.ok) {
+                alert('Failed to generate ISBNs: ' + (job.error || 'Unknown error'));
+                return;
+            }
+            
+            // Poll the job until it finishes, showing its progress
+            while (job.status === 'queued' || job.status === 'running') {
+                batchGenerateBtn.textContent = `Generating... ${Math.floor(job.progress * 100)}%`;
+                await new Promise(resolve => setTimeout(resolve, 500));
+                job = await (await fetch(job.status_url || `/api/batch-jobs/${job.job_id}`)).json();
+            }
+            
+            // Fetch the generated ISBNs page by page
+            const data = { isbns: [], prefix: job.prefix, error: job.error };
+            let offset = 0;
+            while (offset !== null && offset < job.generated) {
+                const page = await (await fetch(`/api/batch-jobs/${job.job_id}/isbns?offset=${offset}&limit=10000`)).json();
+                data.isbns.push(...page.isbns);
+                offset = page.next_offset;
+            }
             
             if (data.isbns && data.isbns.length > 0) {
                 // Update summary
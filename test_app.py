@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import io
+import json
+import os
+import pstats
+import time
+import isbn13_crt
+from isbn13_crt import ISBNStorage, check_isbn, get_prefix_slots
+from app import app
+
+def test_batch_job_progress_and_pages(tmp_path, monkeypatch):
+    """A batch job runs in the background, reports progress and serves its ISBNs page by page"""
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", ISBNStorage(str(tmp_path / "isbns.json")))
+    client = app.test_client()
+    
+    response = client.post('/api/batch-jobs', json={'country_code': '3', 'publisher_code': '16', 'count': 1000, 'use_multiples': False})
+    assert response.status_code == 202
+    job = response.get_json()
+    
+    deadline = time.time() + 30
+    while job['status'] in ('queued', 'running') and time.time() < deadline:
+        time.sleep(0.05)
+        job = client.get(job['status_url']).get_json()
+    
+    # The prefix runs out of unique ISBNs before the requested count
+    assert job['status'] == 'done'
+    assert job['generated'] == len(get_prefix_slots("978316"))
+    
+    isbns = []
+    offset = 0
+    while offset is not None:
+        page = client.get(f"/api/batch-jobs/{job['job_id']}/isbns?offset={offset}&limit=500").get_json()
+        isbns.extend(page['isbns'])
+        offset = page['next_offset']
+    assert len(set(isbns)) == job['generated']
+    assert isbns[0] == "9783160006636"
+    
+    assert client.get('/api/batch-jobs/unknown').status_code == 404
+    assert client.post('/api/batch-jobs', json={'count': 0}).status_code == 400
+
+def test_streaming_batch_and_export(tmp_path, monkeypatch):
+    """Streamed batches are stored chunk by chunk and the export streams every stored ISBN"""
+    storage = ISBNStorage(str(tmp_path / "isbns.json"))
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", storage)
+    client = app.test_client()
+    
+    response = client.post('/api/batch-generate/stream', json={'count': 300, 'use_multiples': False})
+    assert response.mimetype == 'application/x-ndjson'
+    isbns = [json.loads(line)['isbn'] for line in response.get_data(as_text=True).splitlines()]
+    assert len(isbns) == 300 and isbns[0] == "9783160006636"
+    
+    response = client.post('/api/batch-generate/stream', json={'count': 5, 'format': 'csv', 'use_multiples': False})
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'isbn' and len(lines) == 6
+    assert storage.count_isbns() == 305
+    
+    lines = client.get('/api/export?format=csv').get_data(as_text=True).splitlines()
+    assert lines[0] == 'publisher_code,isbn'
+    assert lines[1:] == [f"16,{isbn}" for isbn in storage.list_isbns_for_publisher(16)]
+    assert client.post('/api/batch-generate/stream', json={'format': 'xml'}).status_code == 400
+
+def test_validate_batch(monkeypatch):
+    """Batch validation accepts JSON arrays and line uploads and rejects oversized batches"""
+    import app as app_module
+    client = app.test_client()
+    isbns = ["9783160006636", "9783160006637", "978316000663", "9783160021651"]
+    
+    result = client.post('/api/validate-batch', json={'isbns': isbns, 'corrections': True}).get_json()
+    assert result['valid'] == [1, 0, 0, 1]
+    assert (result['valid_count'], result['invalid_count'], result['malformed_count']) == (2, 1, 1)
+    assert result['corrected_isbns'] == {"1": check_isbn("9783160006637", verbose=False)[1]['corrected_isbn']}
+    assert client.post('/api/validate-batch', json={'isbns': isbns, 'corrections': "false"}).status_code == 400
+    
+    body = "\r\n".join(isbns * 3000).encode()
+    result = client.post('/api/validate-batch', data=body, content_type='text/plain').get_json()
+    assert result['count'] == 12000 and result['valid'][:4] == [1, 0, 0, 1]
+    assert 'corrected_isbns' not in result
+    
+    monkeypatch.setattr(app_module, "MAX_VALIDATE_BATCH_SIZE", 3)
+    assert client.post('/api/validate-batch', json=isbns).status_code == 413
+    
+    # Chunked uploads carry no Content-Length but are capped while they are read
+    monkeypatch.setattr(app_module, "MAX_VALIDATE_BATCH_SIZE", 10)
+    monkeypatch.setattr(app_module, "MAX_VALIDATE_BODY_BYTES", 100)
+    def post_chunked(body):
+        return client.post(
+            '/api/validate-batch', input_stream=io.BytesIO(body), content_type='application/json',
+            headers={'Transfer-Encoding': 'chunked'}, environ_overrides={'wsgi.input_terminated': True}
+        )
+    assert post_chunked(json.dumps(isbns).encode()).get_json()['valid'] == [1, 0, 0, 1]
+    assert post_chunked(json.dumps(isbns).encode() + b' ' * 100).status_code == 413
+
+def test_finished_jobs_expire(monkeypatch):
+    """Finished jobs keep their ISBNs compactly and are discarded once their TTL has passed"""
+    from isbn_jobs import JobManager
+    monkeypatch.setattr(isbn13_crt, "generate_isbns", lambda prefix, count, use_multiples: ["9783160006636"] * count)
+    manager = JobManager(max_workers=1, ttl=60)
+    job = manager.submit("978316", 3)
+    manager.shutdown()
+    assert job.status == 'done' and job.isbns.integers.itemsize == 8 and job.isbns[:] == ["9783160006636"] * 3
+    
+    assert manager.get(job.id) is job
+    job.finished_at -= 61
+    assert manager.get(job.id) is None
+
+def test_metrics_endpoint(tmp_path, monkeypatch):
+    """Generation counters and stage latencies are exposed in the Prometheus text format only when enabled"""
+    from isbn_metrics import registry
+    storage = ISBNStorage(str(tmp_path / "isbns.json"))
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", storage)
+    client = app.test_client()
+    assert client.get('/api/metrics').status_code == 404
+    
+    monkeypatch.setattr(registry, "enabled", True)
+    registry.reset()
+    try:
+        client.post('/api/generate', json={'use_multiples': False})
+        client.post('/api/generate', json={})
+        isbn13_crt.generate_isbns(count=3, storage=storage)
+        
+        response = client.get('/api/metrics')
+        assert response.mimetype == 'text/plain'
+        lines = response.get_data(as_text=True).splitlines()
+        assert 'isbn_issued_total{prefix="978316"} 5' in lines
+        assert any(line.startswith('isbn_multiple_attempts_total{prefix="978316"} ') for line in lines)
+        assert 'isbn_stage_seconds_count{stage="generate_batch"} 1' in lines
+        assert 'isbn_stage_seconds_bucket{stage="generate",le="+Inf"} 2' in lines
+        assert 'isbn_http_request_seconds_count{endpoint="/api/generate",status="200"} 2' in lines
+    finally:
+        registry.reset()
+
+def test_request_profiling(tmp_path, monkeypatch):
+    """An X-Profile header writes a profile of the request only when request profiling is allowed"""
+    import app as app_module
+    monkeypatch.chdir(tmp_path)
+    client = app.test_client()
+    headers = {'X-Profile': 'cpu'}
+    
+    response = client.post('/api/validate', json={'isbn': '9783160006636'}, headers=headers)
+    assert 'X-Profile-Output' not in response.headers
+    
+    monkeypatch.setattr(app_module, "PROFILE_REQUESTS", True)
+    response = client.post('/api/validate', json={'isbn': '9783160006636'}, headers=headers)
+    stats_path, summary_path = response.headers['X-Profile-Output'].split(', ')
+    assert stats_path.endswith('.prof') and os.path.exists(summary_path)
+    assert 'fast_check_isbn' in {function for _, _, function in pstats.Stats(stats_path).stats}
+    
+    response = client.get('/api/isbn-count', headers={'X-Profile': 'memory'})
+    assert response.headers['X-Profile-Output'].split(', ')[0].endswith('.tracemalloc')
+    assert client.get('/api/isbn-count', headers={'X-Profile': 'disk'}).status_code == 400
+
+def test_validate_suggests_nearest_unused(tmp_path, monkeypatch):
+    """Validation suggests the nearest valid ISBNs of the prefix that are not in storage yet"""
+    storage = ISBNStorage(str(tmp_path / "isbns.json"))
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", storage)
+    isbn13_crt.generate_isbns(count=2, use_multiples=False, storage=storage)
+    client = app.test_client()
+    
+    result = client.post('/api/validate', json={'isbn': '9783160021650', 'suggestions': 3}).get_json()
+    assert not result['valid']
+    assert result['suggested_isbns'] == ["9783160036666", "9783160051681", "9783160066696"]
+    assert all(check_isbn(isbn, verbose=False)[0] for isbn in result['suggested_isbns'])
+    
+    # A valid, unused ISBN is its own nearest suggestion; the last slot has no neighbour above
+    slots = get_prefix_slots("978316")
+    last = slots.isbn(len(slots) - 1)
+    assert check_isbn(last, verbose=False, suggestions=2)[1]['suggested_isbns'] == [last, slots.isbn(len(slots) - 2)]
+    assert 'suggested_isbns' not in client.post('/api/validate', json={'isbn': last}).get_json()
+    assert client.post('/api/validate', json={'isbn': last, 'suggestions': 1000}).status_code == 400
+    assert client.post('/api/validate', json={'isbn': last, 'suggestions': True}).status_code == 400
+
+def test_validate_rejects_near_digit_input():
+    """Inputs that only look like 13 digits are rejected instead of failing the check"""
+    client = app.test_client()
+    for isbn in ("9783160006636\n", "９７８３１６０００６６３６"):
+        response = client.post('/api/validate', json={'isbn': isbn})
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'ISBN must be 13 digits'}
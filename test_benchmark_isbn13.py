@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+import json
+from benchmark_isbn13 import run_benchmarks, compare_results
+
+def test_benchmark_runner_smoke(tmp_path):
+    """The benchmark runner completes on tiny stores and its JSON results compare cleanly"""
+    results = run_benchmarks(sizes=(100,), rounds=5, work_dir=str(tmp_path))
+    assert results['storage']['100']['isbns'] == 100
+    assert results['generate_isbn']['100']['offsets']['calls'] == 5
+    assert results['validation']['check_isbn']['ops_per_sec'] > 0
+    
+    reloaded = json.loads(json.dumps(results))
+    comparison = compare_results(reloaded, results)
+    assert comparison and not any(regressed for *_, regressed in comparison)
@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 import re
 import sys
-from isbn13_crt import generate_isbn, check_isbn
+import pytest
+import isbn13_crt
+from isbn13_crt import (
+    generate_isbn, generate_isbns, check_isbn, find_multiple_slot, get_prefix_slots, ISBNStorage, ISBNScheme, SlotAllocator
+)
 
 # Number of ISBNs to generate
 NUM_TO_GENERATE = 100
 PREFIX = "978316"
 
+@pytest.fixture(autouse=True)
+def isolated_storage(tmp_path, monkeypatch):
+    """Keep the default storage and the files written by the tests out of the working directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", ISBNStorage(str(tmp_path / "generated_isbns.json")))
+
 def test_isbn_generation():
     """Generate and verify multiple ISBNs with the same prefix"""
     print(f"Generating {NUM_TO_GENERATE} ISBNs with prefix {PREFIX}...")
@@ -46,5 +56,88 @@ def test_isbn_generation():
                 f.write(f"{i}. {isbn} (Format: {isbn[:3]}-{isbn[3:4]}-{isbn[4:6]}-{isbn[6:]})\n")
         print(f"Saved all ISBNs to {filename}")
 
+def test_prefix_exhaustion(tmp_path, monkeypatch):
+    """Every slot of a prefix is handed out exactly once before generation reports exhaustion"""
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", ISBNStorage(str(tmp_path / "isbns.json")))
+    slots = get_prefix_slots(PREFIX)
+
+    isbns = [generate_isbn(prefix=PREFIX, verbose=False, use_multiples=False) for _ in range(len(slots))]
+    assert len(set(isbns)) == len(slots)
+    assert all(check_isbn(isbn, verbose=False)[0] for isbn in isbns)
+    assert generate_isbn(prefix=PREFIX, verbose=False) is None
+
+def test_batch_generation_single_commit(tmp_path, monkeypatch):
+    """A batch yields unique valid ISBNs, is persisted once and stops at the prefix capacity"""
+    storage = ISBNStorage(str(tmp_path / "isbns.json"))
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", storage)
+    generate_isbn(prefix=PREFIX, verbose=False)
+
+    isbns = generate_isbns(prefix=PREFIX, count=100000)
+    assert len(isbns) == len(get_prefix_slots(PREFIX)) - 1
+    assert all(check_isbn(isbn, verbose=False)[0] for isbn in isbns)
+    assert storage.count_isbns() == len(get_prefix_slots(PREFIX))
+
+    with open(storage.journal_file) as f:
+        assert len(f.readlines()) == storage.count_isbns()
+    assert generate_isbns(prefix=PREFIX, count=1) == []
+
+def test_custom_scheme(tmp_path, monkeypatch):
+    """Storage created with another moduli set generates and reloads ISBNs valid under that scheme"""
+    scheme = ISBNScheme(moduli=(7, 11, 13))
+    storage_file = str(tmp_path / "isbns.json")
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", ISBNStorage(storage_file, compact_every=1, scheme=scheme))
+    
+    slots = scheme.slots(PREFIX)
+    assert slots is scheme.slots(PREFIX) and slots is not get_prefix_slots(PREFIX)
+    assert len(slots) == 9990
+    isbns = generate_isbns(prefix=PREFIX, count=20, use_multiples=False)
+    assert all(check_isbn(isbn, verbose=False, scheme=scheme)[0] for isbn in isbns)
+    assert check_isbn(isbns[1], verbose=False, scheme=scheme)[1]["expected_remainders"] == [16 % 7, 16 % 11, 16 % 13]
+    assert not all(check_isbn(isbn, verbose=False)[0] for isbn in isbns)
+    
+    # The stored bitmaps only apply to the scheme they were written with
+    assert ISBNStorage(storage_file, scheme=scheme).remaining_capacity(PREFIX) == 9970
+    assert ISBNStorage(storage_file).remaining_capacity(PREFIX) == len(get_prefix_slots(PREFIX)) - 1
+
+def test_multiples_search_follows_scheme_modulus(monkeypatch):
+    """The multiples search tries as many multiples as the scheme's modulus by default"""
+    from isbn_metrics import registry, MULTIPLE_ATTEMPTS
+    monkeypatch.setattr(registry, "enabled", True)
+    registry.reset()
+    
+    scheme = ISBNScheme(moduli=(7, 11, 13))
+    slots = scheme.slots(PREFIX)
+    allocator = SlotAllocator(len(slots))
+    allocator.allocate(len(slots))
+    assert find_multiple_slot(slots, allocator, slots.book_number(1)) == (None, None)
+    assert MULTIPLE_ATTEMPTS.value(PREFIX) == scheme.modulus == 1001
+    registry.reset()
+
+def test_batch_multiples_continue_from_last_isbn(tmp_path):
+    """Batches take each multiple from the previous ISBN, like consecutive generate_isbn calls"""
+    sequential_storage = ISBNStorage(str(tmp_path / "sequential.json"))
+    sequential = [generate_isbn(prefix=PREFIX, verbose=False, storage=sequential_storage) for _ in range(4)]
+    
+    batch_storage = ISBNStorage(str(tmp_path / "batch.json"))
+    batch = [generate_isbn(prefix=PREFIX, verbose=False, storage=batch_storage)]
+    batch += generate_isbns(prefix=PREFIX, count=3, storage=batch_storage)
+    assert batch == sequential
+    assert batch_storage.get_last_book_number(PREFIX) == int(batch[-1][6:])
+
+def test_storage_is_lazy_and_injectable(tmp_path):
+    """Importing and validating do not open the default storage, and generation can target an explicit store"""
+    import os
+    import subprocess
+    code = "import isbn13_crt; isbn13_crt.check_isbn('9783160006637', verbose=False); print('isbn_storage' in vars(isbn13_crt))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=os.path.dirname(isbn13_crt.__file__)))
+    assert output.stdout.strip() == "False"
+    
+    storage = ISBNStorage(str(tmp_path / "isbns.json"))
+    isbns = generate_isbns(prefix=PREFIX, count=3, use_multiples=False, storage=storage)
+    assert storage.count_isbns() == 3
+    assert check_isbn(isbns[0], verbose=False, storage=storage)[1]["in_storage"]
+    assert not check_isbn(isbns[0], verbose=False, storage=ISBNStorage(str(tmp_path / "other.json")))[1]["in_storage"]
+
 if __name__ == "__main__":
     test_isbn_generation() 
\ No newline at end of file
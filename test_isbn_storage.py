@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+import json
+import os
+import pytest
+from isbn13_crt import ISBNList, ISBNStorage, SlotAllocator
+
+def test_journal_replay(tmp_path):
+    """ISBNs appended to the journal survive a reload without a snapshot rewrite"""
+    storage_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(storage_file)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    storage.add_isbn(16, "9783160021651", "978316", 1)
+
+    assert not os.path.exists(storage_file)
+    assert os.path.exists(storage.journal_file)
+
+    reloaded = ISBNStorage(storage_file)
+    assert reloaded.list_isbns_for_publisher(16) == ["9783160006636", "9783160021651"]
+    assert reloaded.get_next_offset("978316") == 2
+
+def test_journal_compaction(tmp_path):
+    """The journal is folded into the JSON snapshot once it reaches compact_every records"""
+    storage_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(storage_file, compact_every=2)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    storage.add_isbn(16, "9783160021651", "978316", 1)
+
+    assert not os.path.exists(storage.journal_file)
+    with open(storage_file) as f:
+        data = json.load(f)
+    assert data['isbns'] == {"16": ["9783160006636", "9783160021651"]}
+    assert data['prefix_offsets'] == {"978316": 1}
+
+def test_journal_skips_torn_record(tmp_path):
+    """A partially written last journal record is ignored on replay"""
+    storage_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(storage_file)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    with open(storage.journal_file, 'a') as f:
+        f.write('{"publisher_code": "16", "isb')
+
+    reloaded = ISBNStorage(storage_file)
+    assert reloaded.count_isbns() == 1
+
+def test_last_book_number_is_most_recent(tmp_path):
+    """The last book number of a prefix follows the latest ISBN through the journal and old snapshots"""
+    storage_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(storage_file, compact_every=2)
+    storage.add_isbn(16, "9783160021651", "978316", 1)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    assert storage.get_last_book_number("978316") == 6636
+    storage.add_isbn(16, "9783160036666", "978316", 2)
+    assert ISBNStorage(storage_file).get_last_book_number("978316") == 36666
+    
+    # Snapshots written before the book numbers were tracked derive them from the ISBN lists
+    with open(storage_file) as f:
+        data = json.load(f)
+    del data['last_book_numbers']
+    with open(storage_file, 'w') as f:
+        json.dump(data, f)
+    os.remove(storage.journal_file)
+    assert ISBNStorage(storage_file).get_last_book_number("978316") == 6636
+    assert ISBNStorage(storage_file).get_last_book_number("978317") is None
+
+def test_reads_see_other_instances_writes(tmp_path):
+    """Reads catch up with ISBNs another instance appended or compacted, without a transaction"""
+    storage_file = str(tmp_path / "isbns.json")
+    writer = ISBNStorage(storage_file, compact_every=2)
+    reader = ISBNStorage(storage_file)
+    
+    writer.add_isbn(16, "9783160006636", "978316", 0)
+    assert reader.is_isbn_generated("9783160006636")
+    assert reader.count_isbns() == 1
+    
+    # The second ISBN compacts the journal into a new snapshot
+    writer.add_isbn(16, "9783160021651", "978316", 1)
+    assert reader.list_isbns_for_publisher(16) == ["9783160006636", "9783160021651"]
+    assert reader.count_isbns_for_prefix("978316") == 2
+    assert list(reader.iter_isbns()) == [("16", "9783160006636"), ("16", "9783160021651")]
+
+def test_is_isbn_generated_uses_index(tmp_path):
+    """Membership checks see ISBNs from the snapshot, the journal and new additions"""
+    storage_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(storage_file, compact_every=1)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    storage = ISBNStorage(storage_file)
+    storage.add_isbn(16, "9783160021651", "978316", 1)
+
+    reloaded = ISBNStorage(storage_file)
+    assert reloaded.is_isbn_generated("9783160006636")
+    assert reloaded.is_isbn_generated(9783160021651)
+    assert not reloaded.is_isbn_generated("9783160036666")
+
+def test_compact_isbn_lists(tmp_path):
+    """ISBNs are held as integers but read back as strings, in insertion order, and written as JSON lists"""
+    storage_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(storage_file, compact_every=3)
+    storage.add_isbn(16, "9783160021651", "978316", 1)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    storage.add_isbn(0, "0123000000000", "012300", 0)
+    
+    isbns = storage.isbns["16"]
+    assert isinstance(isbns, ISBNList) and isbns.integers.itemsize == 8
+    assert isbns == ["9783160021651", "9783160006636"] and isbns[-1] == "9783160006636"
+    assert storage.is_isbn_generated("9783160006636") and not storage.is_isbn_generated("978316000663")
+    assert storage.list_isbns_for_publisher(0) == ["0123000000000"]
+    assert json.dumps(storage.list_isbns_for_publisher(16)) == '["9783160021651", "9783160006636"]'
+    
+    with open(storage_file) as f:
+        assert json.load(f)['isbns'] == {"16": ["9783160021651", "9783160006636"], "0": ["0123000000000"]}
+    reloaded = ISBNStorage(storage_file)
+    assert reloaded.is_isbn_generated("0123000000000") and reloaded.is_isbn_generated(9783160021651)
+    assert not reloaded.is_isbn_generated("978316002165") and not reloaded.is_isbn_generated("9783160021652")
+    assert reloaded.count_isbns_for_prefix("978316") == 2
+
+def test_load_skips_malformed_isbns(tmp_path, capsys):
+    """A snapshot with a malformed ISBN entry still loads, without that entry"""
+    storage_file = tmp_path / "isbns.json"
+    storage_file.write_text(json.dumps({'isbns': {"16": ["9783160006636", "978-3-16-002165-1", None]}, 'prefix_offsets': {}}))
+    
+    storage = ISBNStorage(str(storage_file))
+    assert storage.list_isbns_for_publisher(16) == ["9783160006636"]
+    assert storage.is_isbn_generated("9783160006636") and storage.count_isbns() == 1
+    assert "Skipping 2 malformed ISBN(s)" in capsys.readouterr().out
+
+def test_slot_allocator():
+    """The allocator hands out free slots in order, wraps around and tracks capacity"""
+    allocator = SlotAllocator(8)
+    assert allocator.allocate(3) == [0, 1, 2]
+    allocator.mark_used(5)
+    assert allocator.next_free(4) == 4
+    assert allocator.prev_free(5) == 4 and allocator.prev_free(2) is None
+    assert allocator.next_free(6, wrap=False) == 6 and allocator.next_free(8, wrap=False) is None
+    assert allocator.allocate(2, contiguous=True) == [3, 4]
+    assert allocator.allocate(3, contiguous=True) == []
+    assert allocator.allocate(2, start=7) == [7, 6]
+    assert allocator.free_count == 0
+    assert allocator.next_free() is None
+
+def test_slot_bitmaps_persist(tmp_path):
+    """Slot bitmaps are written with the snapshot and restored together with journal records"""
+    storage_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(storage_file, compact_every=1)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    storage = ISBNStorage(storage_file)
+    storage.add_isbn(16, "9783160036666", "978316", 2)
+
+    with open(storage_file) as f:
+        assert json.load(f)['slot_bitmaps'] == {"978316": "1"}
+
+    allocator = ISBNStorage(storage_file).get_slot_allocator("978316")
+    assert allocator.is_used(0) and allocator.is_used(2)
+    assert allocator.next_free() == 1
+    assert allocator.free_count == allocator.capacity - 2
+
+def test_mmap_storage_conversion(tmp_path):
+    """The JSON converter carries ISBNs and offsets over to a memory-mapped store"""
+    from isbn_mmap_storage import MmapISBNStorage, convert_json_storage
+    json_file = str(tmp_path / "isbns.json")
+    storage = ISBNStorage(json_file)
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    storage.add_isbn(16, "9783160036666", "978316", 2)
+    storage.add_isbn(16, "9783160006637", "978316", 2)
+
+    map_file = str(tmp_path / "isbns.isbnmap")
+    assert convert_json_storage(json_file, map_file) == (2, 1)
+
+    mapped = MmapISBNStorage(map_file)
+    assert mapped.count_isbns() == 2
+    assert mapped.is_isbn_generated("9783160036666")
+    assert not mapped.is_isbn_generated("9783160021651")
+    assert mapped.get_next_offset("978316") == 3
+    assert mapped.get_slot_allocator("978316").next_free() == 1
+    assert mapped.list_isbns_for_publisher(16) == ["9783160006636", "9783160036666"]
+    mapped.close()
+
+def test_sqlite_storage(tmp_path, monkeypatch):
+    """Generation works on the SQLite backend and duplicate ISBNs are rejected by the unique index"""
+    import sqlite3
+    import isbn13_crt
+    storage = isbn13_crt.open_storage(str(tmp_path / "isbns.sqlite"))
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", storage)
+
+    isbns = isbn13_crt.generate_isbns(prefix="978316", count=5, use_multiples=False)
+    assert isbn13_crt.generate_isbn(prefix="978316", verbose=False, use_multiples=False) == "9783160081711"
+    assert storage.count_isbns() == 6
+    assert storage.count_isbns_for_prefix("978316") == 6
+    assert storage.get_next_offset("978316") == 6
+    assert storage.list_isbns_for_publisher(16)[:5] == isbns
+    assert storage.get_slot_allocator("978316").free_count == 660
+
+    with pytest.raises(sqlite3.IntegrityError):
+        storage.add_isbns([(16, "9783160096726", "978316", 6), (16, isbns[0], "978316", 0)])
+    assert not storage.is_isbn_generated("9783160096726")
+
+def _generate_in_process(storage_file, count):
+    """Generate ISBNs one at a time from a separate process with its own storage instance"""
+    import isbn13_crt
+    isbn13_crt.isbn_storage = isbn13_crt.open_storage(storage_file)
+    return [isbn13_crt.generate_isbn(prefix="978316", verbose=False, use_multiples=False) for _ in range(count)]
+
+@pytest.mark.parametrize("storage_name", ["isbns.json", "isbns.isbnmap", "isbns.sqlite"])
+def test_concurrent_generation_is_unique(tmp_path, storage_name):
+    """Processes sharing one storage file never hand out the same ISBN"""
+    from concurrent.futures import ProcessPoolExecutor
+    storage_file = str(tmp_path / storage_name)
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(_generate_in_process, [storage_file] * 4, [25] * 4))
+
+    isbns = [isbn for result in results for isbn in result]
+    assert None not in isbns
+    assert len(set(isbns)) == 100
+
+    import isbn13_crt
+    assert isbn13_crt.open_storage(storage_file).count_isbns() == 100
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+import gzip
+import json
+import pytest
+from check_file_isbns import check_file_isbns
+import isbn13_crt
+from isbn13_crt import check_isbn, check_isbns_array, cached_check_isbn, fast_check_isbn, ISBNStorage, ValidationCache
+
+ISBNS = ["9783160006636", "9783160006637", "9783160021651", "9780010000000"]
+
+def test_check_isbns_array_matches_check_isbn():
+    """Batch validation agrees with check_isbn for integer and buffer input"""
+    expected_valid = [check_isbn(isbn, verbose=False)[0] for isbn in ISBNS]
+
+    valid, expected, actual = check_isbns_array([int(isbn) for isbn in ISBNS], use_numpy=False)
+    assert valid == expected_valid
+    assert actual[0] == check_isbn(ISBNS[0], verbose=False)[1]["actual_remainders"]
+
+    buffer = "\n".join(ISBNS).encode()
+    assert check_isbns_array(buffer, use_numpy=False)[0] == expected_valid
+
+def test_fast_check_isbn_matches_check_isbn():
+    """The fast path agrees with check_isbn for every input type and rejects malformed input"""
+    for isbn in ISBNS:
+        is_valid, info = check_isbn(isbn, verbose=False)
+        for value in (isbn, isbn.encode(), bytearray(isbn.encode()), memoryview(isbn.encode()), int(isbn)):
+            valid, publisher_code, residue = fast_check_isbn(value)
+            assert (valid, publisher_code) == (is_valid, info["publisher_code"])
+            assert [residue % m for m in (3, 5, 7, 11, 13)] == info["actual_remainders"]
+    
+    for malformed in ("97831600x6636", b"978316000663", "９７８３１６０００６６３６", 978316000663):
+        assert fast_check_isbn(malformed) == (False, None, None)
+
+def test_check_isbns_array_rejects_malformed_records():
+    """Records with non-digit bytes are reported as invalid"""
+    valid, _, _ = check_isbns_array(b"97831600x6636\n9783160006636\n", use_numpy=False)
+    assert valid == [False, True]
+
+def test_check_isbns_array_detects_crlf_records():
+    """Records separated by CRLF are read as 15-byte records by both engines"""
+    buffer = b"9783160006636\r\n9783160021651\r\n9783160036667\r\n"
+    assert check_isbns_array(buffer, use_numpy=False)[0] == [True, True, False]
+    if isbn13_crt.np is not None:
+        assert check_isbns_array(buffer, use_numpy=True)[0].tolist() == [True, True, False]
+    assert check_isbns_array(buffer[:-2], use_numpy=False)[0] == [True, True, False]
+
+def test_check_isbns_array_numpy_matches_fallback():
+    """The NumPy engine returns the same results as the pure Python fallback"""
+    np = pytest.importorskip("numpy")
+    buffer = "\n".join(ISBNS + ["97831600x6636"]).encode()
+
+    valid, expected, actual = check_isbns_array(buffer, use_numpy=True)
+    fallback = check_isbns_array(buffer, use_numpy=False)
+    assert valid.tolist() == fallback[0]
+    assert expected.tolist() == fallback[1]
+    assert actual.tolist() == fallback[2]
+
+    values = np.array([int(isbn) for isbn in ISBNS], dtype=np.uint64)
+    assert check_isbns_array(values)[0].tolist() == fallback[0][:len(ISBNS)]
+
+def test_check_isbns_array_engines_agree_on_short_integers():
+    """Both engines reject integers with fewer than 13 digits, even when their remainders match"""
+    pytest.importorskip("numpy")
+    values = [100000005105, 9783160006636, 5105, 9783160006637]
+    fallback = check_isbns_array(values, use_numpy=False)
+    assert fallback[0] == [False, True, False, False]
+    
+    valid, expected, actual = check_isbns_array(values, use_numpy=True)
+    assert valid.tolist() == fallback[0]
+    assert expected.tolist() == fallback[1] and actual.tolist() == fallback[2]
+
+def test_check_file_isbns_streams_gzip_report(tmp_path):
+    """The file checker reads gzip input and reports invalid ISBNs with their line numbers"""
+    isbn_file = tmp_path / "isbns.txt.gz"
+    with gzip.open(isbn_file, "wt") as f:
+        f.write("Generated ISBNs with prefix 978316:\n\n")
+        for i, isbn in enumerate(ISBNS, 1):
+            f.write(f"{i}. {isbn} (Format: {isbn[:3]}-{isbn[3:4]}-{isbn[4:6]}-{isbn[6:]})\n")
+
+    report = tmp_path / "invalid.jsonl"
+    summary = check_file_isbns(str(isbn_file), report=str(report), batch_size=2)
+    assert summary == {'checked': 4, 'invalid': 2}
+
+    rows = [json.loads(line) for line in report.read_text().splitlines()]
+    assert [(row['line'], row['isbn']) for row in rows] == [(4, "9783160006637"), (6, "9780010000000")]
+
+def test_check_file_isbns_parallel_matches_sequential(tmp_path):
+    """Worker processes report the same invalid rows, in input order, as a single process"""
+    isbn_file = tmp_path / "isbns.txt"
+    isbn_file.write_text("\n".join(ISBNS * 50))
+    
+    reports = []
+    for workers in (1, 3):
+        report = tmp_path / f"invalid_{workers}.csv"
+        summary = check_file_isbns(str(isbn_file), report=str(report), workers=workers, batch_size=7)
+        assert summary == {'checked': 200, 'invalid': 100}
+        reports.append(report.read_text())
+    assert reports[0] == reports[1]
+
+def test_validation_cache_invalidated_on_add(tmp_path, monkeypatch):
+    """Cached results are reused and refreshed once their ISBN is added to storage"""
+    storage = ISBNStorage(str(tmp_path / "isbns.json"))
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", storage)
+    monkeypatch.setattr(isbn13_crt, "validation_cache", ValidationCache(maxsize=2))
+    cache = isbn13_crt.validation_cache
+    
+    assert cached_check_isbn("9783160006636")[1]["in_storage"] is False
+    assert cached_check_isbn(9783160006636)[0] is True
+    assert (cache.hits, cache.misses) == (1, 1)
+    
+    storage.add_isbn(16, "9783160006636", "978316", 0)
+    assert cached_check_isbn("9783160006636")[1]["in_storage"] is True
+    assert cache.misses == 2
+    
+    # The least recently used ISBN is evicted first
+    cached_check_isbn("9783160021651")
+    cached_check_isbn("9783160036666")
+    assert cache.stats()["size"] == 2
+    cached_check_isbn("9783160006636")
+    assert cache.misses == 5
+
+def test_validation_cache_guards_against_stale_results(tmp_path, monkeypatch):
+    """Results computed before an invalidation are not cached and callers get their own copies"""
+    storage = ISBNStorage(str(tmp_path / "isbns.json"))
+    monkeypatch.setattr(isbn13_crt, "isbn_storage", storage)
+    monkeypatch.setattr(isbn13_crt, "validation_cache", ValidationCache())
+    cache = isbn13_crt.validation_cache
+    
+    # The ISBN is added while its check is running
+    real_check_isbn = isbn13_crt.check_isbn
+    def racing_check_isbn(*args, **kwargs):
+        result = real_check_isbn(*args, **kwargs)
+        storage.add_isbn(16, "9783160006636", "978316", 0)
+        return result
+    monkeypatch.setattr(isbn13_crt, "check_isbn", racing_check_isbn)
+    assert cached_check_isbn("9783160006636")[1]["in_storage"] is False
+    monkeypatch.setattr(isbn13_crt, "check_isbn", real_check_isbn)
+    assert cached_check_isbn("9783160006636")[1]["in_storage"] is True
+    
+    # Changing a returned result does not change the cached one
+    cached_check_isbn("9783160006636")[1]["actual_remainders"].append(99)
+    assert len(cached_check_isbn("9783160006636")[1]["actual_remainders"]) == 5
+    
+    # Rebinding drops the listener registered on the previous storage
+    other = ISBNStorage(str(tmp_path / "other.json"))
+    cache.bind(other)
+    assert cache.invalidate not in storage._add_listeners
+    assert other._add_listeners.count(cache.invalidate) == 1
+
+def test_validation_cache_sees_other_processes(tmp_path, monkeypatch):
+    """Cached results are refreshed when another storage instance adds their ISBN to the same file"""
+    storage_file = str(tmp_path / "isbns.json")
+    reader = ISBNStorage(storage_file)
+    writer = ISBNStorage(storage_file)
+    monkeypatch.setattr(isbn13_crt, "validation_cache", ValidationCache())
+    
+    assert cached_check_isbn("9783160006636", storage=reader)[1]["in_storage"] is False
+    assert cached_check_isbn("9783160006636", storage=reader)[1]["in_storage"] is False
+    writer.add_isbn(16, "9783160006636", "978316", 0)
+    assert cached_check_isbn("9783160006636", storage=reader)[1]["in_storage"] is True